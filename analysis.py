@@ -1,69 +1,293 @@
 # analysis.py
+import numpy as np
 import pandas as pd
-from clustering import compute_time_spent
+from data_load import month_codes, month_label, month_code_of, EARTH_RADIUS_M
 
 
-def top_locations_monthly(df, n=5):
-    df = df.copy()
+def _point_months(df):
+    """Month code of every row, reusing the clustered frame's 'month' column."""
+    if "month" in df.columns and pd.api.types.is_integer_dtype(df["month"]):
+        return df["month"].to_numpy()
+    return month_codes(df["datetime"])
 
-    # Exclude noise cluster
-    if "cluster" in df.columns:
-        df = df[df["cluster"] != -1]
 
-    df["month"] = df["datetime"].dt.to_period("M")
-    monthly = {}
-    for month, group in df.groupby("month"):
-        dwell = compute_time_spent(group)
+def point_dwell_hours(df):
+    """
+    Hours since the previous fix for every row of a time-sorted frame,
+    measured on the full sequence (noise included) and reset to 0 at the
+    first fix of each month.
+    """
+    times = df["datetime"].to_numpy()
+    hours = np.zeros(len(times))
+    hours[1:] = (times[1:] - times[:-1]) / np.timedelta64(1, "h")
+
+    month_code = _point_months(df)
+    new_month = np.ones(len(month_code), dtype=bool)
+    new_month[1:] = month_code[1:] != month_code[:-1]
+    hours[new_month] = 0.0
+    return hours
+
+
+def build_dwell_facts(df):
+    """
+    One vectorized pass over a user's clustered points producing a small fact
+    table of dwell hours keyed by (month, cluster, is_weekend, hour).
+
+    Dwell per point comes from point_dwell_hours, so filtering noise or
+    splitting by weekday later does not merge gaps.
+    """
+    if not df["datetime"].is_monotonic_increasing:
+        df = df.sort_values("datetime", kind="stable")
+    dt = df["datetime"]
+
+    points = pd.DataFrame({
+        "month_code": _point_months(df),
+        "cluster": df["cluster"].to_numpy(),
+        "is_weekend": dt.dt.dayofweek.to_numpy() >= 5,
+        "hour": dt.dt.hour.to_numpy().astype(np.int8),
+        "hours": point_dwell_hours(df),
+    })
+    facts = (
+        points.groupby(["month_code", "cluster", "is_weekend", "hour"], sort=True)
+        .agg(hours=("hours", "sum"), points=("hours", "size"))
+        .reset_index()
+    )
+
+    labels = {c: month_label(c) for c in facts["month_code"].unique()}
+    facts.insert(0, "month", facts["month_code"].map(labels))
+    return facts.drop(columns="month_code")
+
+
+def cluster_centroids(df):
+    """Mean position and point count of every (month, cluster), noise excluded."""
+    keep = df["cluster"].to_numpy() != -1
+    points = pd.DataFrame({
+        "month_code": _point_months(df)[keep],
+        "cluster": df["cluster"].to_numpy()[keep],
+        "latitude": df["latitude"].to_numpy()[keep],
+        "longitude": df["longitude"].to_numpy()[keep],
+    })
+    centroids = (
+        points.groupby(["month_code", "cluster"])
+        .agg(centroid_lat=("latitude", "mean"), centroid_lon=("longitude", "mean"),
+             points=("latitude", "size"))
+        .reset_index()
+    )
+    centroids.insert(0, "month", centroids["month_code"].map(month_label))
+    return centroids.drop(columns="month_code")
+
+
+def cluster_extents(df):
+    """
+    Centroid, point count and spatial extent of every (month, cluster),
+    noise excluded: cluster_centroids plus radius_m, the RMS distance of the
+    cluster's points from its centroid (local equirectangular meters).
+    """
+    keep = df["cluster"].to_numpy() != -1
+    month_code = _point_months(df)[keep].astype(np.int64)
+    cluster = df["cluster"].to_numpy()[keep].astype(np.int64)
+    lat = df["latitude"].to_numpy(dtype=np.float64)[keep]
+    lon = df["longitude"].to_numpy(dtype=np.float64)[keep]
+
+    keys, inv, points = np.unique((month_code << 32) + cluster, return_inverse=True, return_counts=True)
+    centroid_lat = np.bincount(inv, weights=lat, minlength=len(keys)) / points
+    centroid_lon = np.bincount(inv, weights=lon, minlength=len(keys)) / points
+    # deviations from the centroid rather than E[x^2] - E[x]^2, which cancels badly
+    dy = np.radians(lat - centroid_lat[inv]) * EARTH_RADIUS_M
+    dx = np.radians(lon - centroid_lon[inv]) * EARTH_RADIUS_M * np.cos(np.radians(centroid_lat[inv]))
+    radius = np.sqrt(np.bincount(inv, weights=dx * dx + dy * dy, minlength=len(keys)) / points)
+
+    codes = pd.Series(keys >> 32)
+    return pd.DataFrame({
+        "month": codes.map({c: month_label(c) for c in codes.unique()}).to_numpy(),
+        "cluster": (keys & 0xFFFFFFFF).astype(np.int32),
+        "centroid_lat": centroid_lat,
+        "centroid_lon": centroid_lon,
+        "points": points,
+        "radius_m": radius,
+    })
+
+
+def point_counts(df):
+    """Point and noise counts plus the set of cluster IDs, for the report summary."""
+    labels = df["cluster"].to_numpy()
+    noise = labels == -1
+    return {"total_points": len(labels), "noise": int(noise.sum()),
+            "clusters": set(np.unique(labels[~noise]).tolist())}
+
+
+def _hours_by_cluster(facts, key="cluster"):
+    """Sum fact-table hours per cluster (or place), sorted like compute_time_spent."""
+    return (
+        facts.groupby(key)["hours"].sum().reset_index()
+        .sort_values("hours", ascending=False, kind="stable")
+        .reset_index(drop=True)
+    )
 
-        # In case it's empty
-        if dwell.empty:
-            monthly[str(month)] = dwell
-            continue
 
+def cluster_hours(df=None, facts=None, include_noise=False):
+    """
+    Total hours per cluster ID over the whole history, largest first. IDs
+    are per month, so this pools unrelated places; see place_hours.
+    """
+    if facts is None:
+        facts = build_dwell_facts(df)
+    if not include_noise:
+        facts = facts[facts["cluster"] != -1]
+    return _hours_by_cluster(facts)
+
+
+def place_hours(facts):
+    """Total hours per place (facts with a 'place' column, see places.py), largest first."""
+    return _hours_by_cluster(facts[facts["place"] != -1], key="place")
+
+
+def top_locations_monthly(df=None, n=5, facts=None):
+    if facts is None:
+        facts = build_dwell_facts(df)
+
+    # Exclude noise cluster
+    facts = facts[facts["cluster"] != -1]
+
+    monthly_hours = facts.groupby(["month", "cluster"])["hours"].sum().reset_index()
+    monthly = {}
+    for month, dwell in monthly_hours.groupby("month", sort=True):
         # Take top n by hours
-        dwell = dwell.sort_values("hours", ascending=False).head(n)
-        monthly[str(month)] = dwell
+        dwell = dwell.sort_values("hours", ascending=False, kind="stable").head(n)
+        monthly[month] = dwell[["cluster", "hours"]].reset_index(drop=True)
 
     return monthly
 
 
-def movement_transitions(df):
-    df = df.copy()
-    df = df.sort_values("datetime").reset_index(drop=True)
+def top_cluster_mask(df, top_clusters):
+    """
+    Boolean row mask selecting the points of each month's listed clusters,
+    where `top_clusters` is {"YYYY-MM": [cluster, ...]} as derived from
+    top_locations_monthly.
+    """
+    pairs = [(month_code_of(m), c) for m, clusters in top_clusters.items() for c in clusters]
+    if not pairs:
+        return np.zeros(len(df), dtype=bool)
+    # (month, cluster) packed into one int64 so the lookup is a single isin
+    wanted = np.array([(m << 32) + c for m, c in pairs], dtype=np.int64)
+    keys = (_point_months(df).astype(np.int64) << 32) + df["cluster"].to_numpy().astype(np.int64)
+    return np.isin(keys, wanted)
+
 
-    df["next_cluster"] = df["cluster"].shift(-1)
+def segment_visits(df):
+    """
+    Run-length encode a user's cluster label sequence into visits.
 
-    # Drop rows where next_cluster is NaN
-    transitions = df.dropna(subset=["next_cluster"]).copy()
+    Noise points are dropped first, so A, noise, A counts as one stay at A.
+    Runs also break at month boundaries because cluster IDs are per month.
+    Returns one row per visit: month, cluster, start, end, duration_hours, points.
+    """
+    if not df["datetime"].is_monotonic_increasing:
+        df = df.sort_values("datetime", kind="stable")
+    keep = df["cluster"].to_numpy() != -1
+    if not keep.any():
+        return pd.DataFrame(columns=["month", "cluster", "start", "end", "duration_hours", "points"])
+
+    labels = df["cluster"].to_numpy()[keep]
+    times = df["datetime"].to_numpy()[keep]
+    month_code = _point_months(df)[keep]
+
+    # a new visit starts wherever the label or the month changes
+    starts = np.flatnonzero(
+        np.concatenate([[True], (labels[1:] != labels[:-1]) | (month_code[1:] != month_code[:-1])])
+    )
+    ends = np.concatenate([starts[1:], [len(labels)]]) - 1
 
-    # Exclude transitions involving noise (-1 -> anything, anything -> -1)
-    transitions = transitions[
-        (transitions["cluster"] != -1) & (transitions["next_cluster"] != -1)
-    ]
+    codes = pd.Series(month_code[starts])
+    visits = pd.DataFrame({
+        "month": codes.map({c: month_label(c) for c in codes.unique()}).to_numpy(),
+        "cluster": labels[starts],
+        "start": times[starts],
+        "end": times[ends],
+        "points": ends - starts + 1,
+    })
+    visits.insert(4, "duration_hours", (visits["end"] - visits["start"]).dt.total_seconds() / 3600)
+    return visits
 
-    if transitions.empty:
-        return pd.DataFrame(columns=["cluster", "next_cluster", "count"])
+
+def transition_matrices(visits):
+    """
+    Sparse visit-to-visit transition counts per month.
+
+    Returns {month: (matrix, cluster_ids)} where matrix[i, j] counts moves
+    from cluster_ids[i] to cluster_ids[j]. Consecutive visits are always
+    different places, so the diagonal stays empty.
+    """
+    from scipy.sparse import coo_matrix
+
+    matrices = {}
+    for month, month_visits in visits.groupby("month", sort=True):
+        cluster_ids, idx = np.unique(month_visits["cluster"].to_numpy(), return_inverse=True)
+        if len(idx) < 2:
+            continue
+        n = len(cluster_ids)
+        counts = coo_matrix(
+            (np.ones(len(idx) - 1, dtype=np.int32), (idx[:-1], idx[1:])), shape=(n, n)
+        ).tocsr()  # duplicates are summed
+        matrices[month] = (counts, cluster_ids)
+    return matrices
+
+
+def movement_transitions(df=None, visits=None):
+    """
+    Counts of moves between distinct places, largest first.
+
+    With a 'place' column on the visits (see places.attach_places) the moves
+    are between user-level places: consecutive visits to the same place
+    (e.g. across a month boundary) are one stay, and moves across months
+    count too. Without it, cluster IDs only mean something within a month,
+    so pairs are counted per month and keep their 'month' column.
+    """
+    if visits is None:
+        visits = segment_visits(df)
+
+    if "place" in visits.columns:
+        visits = visits.sort_values("start", kind="stable")
+        place = visits["place"].to_numpy()
+        place = place[place != -1]
+        moved = place[1:] != place[:-1]
+        pairs = pd.DataFrame({"place": place[:-1][moved], "next_place": place[1:][moved]})
+        counts = pairs.groupby(["place", "next_place"]).size().rename("count").reset_index()
+        return counts.sort_values("count", ascending=False, kind="stable").reset_index(drop=True)
+
+    rows = []
+    for month, (counts, cluster_ids) in transition_matrices(visits).items():
+        counts = counts.tocoo()
+        rows.append(pd.DataFrame({
+            "month": month,
+            "cluster": cluster_ids[counts.row],
+            "next_cluster": cluster_ids[counts.col],
+            "count": counts.data,
+        }))
+
+    if not rows:
+        return pd.DataFrame(columns=["month", "cluster", "next_cluster", "count"])
 
     return (
-        transitions.groupby(["cluster", "next_cluster"])
-        .size()
-        .reset_index(name="count")
-        .sort_values("count", ascending=False)
+        pd.concat(rows, ignore_index=True)
+        .sort_values(["count", "month"], ascending=[False, True], kind="stable")
         .reset_index(drop=True)
     )
 
 
-def weekday_weekend_stats(df):
-    df = df.copy()
+def weekday_weekend_stats(df=None, facts=None):
+    """
+    Weekday and weekend hours per place when the facts carry places (see
+    places.attach_places), else per (month-local) cluster ID.
+    """
+    if facts is None:
+        facts = build_dwell_facts(df)
+    key = "place" if "place" in facts.columns else "cluster"
 
     # Exclude noise cluster
-    if "cluster" in df.columns:
-        df = df[df["cluster"] != -1]
-
-    df["weekday"] = df["datetime"].dt.dayofweek
-    df["is_weekend"] = df["weekday"].isin([5, 6])
+    facts = facts[facts["cluster"] != -1]
 
-    week = compute_time_spent(df.loc[df["is_weekend"] == False])
-    weekend = compute_time_spent(df.loc[df["is_weekend"] == True])
+    week = _hours_by_cluster(facts[~facts["is_weekend"]], key)
+    weekend = _hours_by_cluster(facts[facts["is_weekend"]], key)
 
     return week, weekend
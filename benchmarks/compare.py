@@ -0,0 +1,49 @@
+# benchmarks/compare.py
+"""
+Compare two benchmark result files step by step.
+
+    python benchmarks/compare.py old.json new.json [--threshold 1.2]
+
+Prints old/new seconds and peak MiB per (size, step) with the new/old ratio,
+marks ratios above the threshold as regressions and exits non-zero if any.
+"""
+import sys
+import json
+import argparse
+
+
+def load(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)["results"]
+
+
+def compare(old, new, threshold=1.2, min_seconds=0.05):
+    """Rows of (size, step, metric, old, new, ratio, regressed) for steps in both files."""
+    rows = []
+    for size in old:
+        for step in old[size]:
+            if step not in new.get(size, {}):
+                continue
+            for metric in ("seconds", "peak_mib"):
+                a, b = old[size][step].get(metric), new[size][step].get(metric)
+                if a is None or b is None:
+                    continue
+                ratio = b / a if a else float("inf") if b else 1.0
+                # sub-threshold timings are mostly noise
+                noisy = metric == "seconds" and max(a, b) < min_seconds
+                rows.append((size, step, metric, a, b, ratio, ratio > threshold and not noisy))
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare two benchmark result files")
+    parser.add_argument("old")
+    parser.add_argument("new")
+    parser.add_argument("--threshold", type=float, default=1.2, help="new/old ratio counted as a regression")
+    args = parser.parse_args()
+
+    rows = compare(load(args.old), load(args.new), args.threshold)
+    for size, step, metric, a, b, ratio, regressed in rows:
+        flag = "  REGRESSION" if regressed else ""
+        print(f"{size:>5} {step:<30} {metric:<9} {a:>10.3f} -> {b:>10.3f}  x{ratio:5.2f}{flag}")
+    sys.exit(1 if any(r[-1] for r in rows) else 0)
@@ -0,0 +1,201 @@
+# benchmarks/run_benchmarks.py
+"""
+Time and memory-profile the pipeline's main steps on synthetic users.
+
+    python benchmarks/run_benchmarks.py --sizes 10k,100k
+    python benchmarks/compare.py old.json benchmarks/results.json
+
+Every step runs once untraced for wall/CPU time and once under tracemalloc
+for its peak allocation (skip the second pass with --no-memory). Results
+go to a JSON file with sorted keys and fixed rounding, so `git diff` of the
+committed file shows exactly which numbers moved.
+"""
+import os
+import io
+import gc
+import sys
+import json
+import time
+import argparse
+import platform
+import subprocess
+import tempfile
+import tracemalloc
+from contextlib import redirect_stdout
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import numpy as np
+import pandas as pd
+from synthetic import synthetic_trajectory
+from data_load import clean_gps, filter_trajectory
+from clustering import cluster_locations_per_month
+from analysis import (
+    build_dwell_facts, segment_visits, movement_transitions, cluster_centroids,
+    top_locations_monthly, weekday_weekend_stats, place_hours, point_counts, cluster_extents,
+)
+from places import link_places, attach_places
+from mapping import make_maps_for_user
+from place_index import PlaceAssigner, build_place_indexes, iter_month_frames
+from plots import plot_user_combined
+from main import build_user_report
+
+SIZES = {"10k": 10_000, "100k": 100_000, "1M": 1_000_000, "5M": 5_000_000}
+RESULTS_FILE = os.path.join(ROOT, "benchmarks", "results.json")
+
+# fixed here rather than taken from main so results stay comparable across commits
+MAX_ACCURACY = 50
+TRAJECTORY_FILTER = dict(max_speed_kmh=300, dedup_meters=5)
+# raw points, as main.CLUSTER_PARAMS: the grid pre-aggregation path (cell_meters) is opt-in
+CLUSTER_PARAMS = dict(eps_meters=50, min_samples=5, cell_meters=None, n_jobs=1)
+ASSIGN_ONE_FIXES = 5_000
+
+
+def measure(fn, *args, memory=True, **kwargs):
+    """Run fn once for time and, with memory=True, once more for its tracemalloc peak."""
+    gc.collect()
+    with redirect_stdout(io.StringIO()):
+        wall, cpu = time.perf_counter(), time.process_time()
+        result = fn(*args, **kwargs)
+        wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+
+        stats = {"seconds": round(wall, 3), "cpu_seconds": round(cpu, 3)}
+        if memory:
+            gc.collect()
+            tracemalloc.start()
+            fn(*args, **kwargs)
+            stats["peak_mib"] = round(tracemalloc.get_traced_memory()[1] / 2**20, 1)
+            tracemalloc.stop()
+    return result, stats
+
+
+def bench_size(n_points, seed=0, memory=True):
+    """All steps for one synthetic user of n_points raw fixes, in pipeline order."""
+    results = {}
+    raw = synthetic_trajectory(n_points, seed=seed)
+
+    def record(name, fn, *args, rows_in=None, **kwargs):
+        result, stats = measure(fn, *args, memory=memory, **kwargs)
+        if rows_in is not None:
+            stats["rows_in"] = int(rows_in)
+        results[name] = stats
+        print(f"  {name:<28} {stats['seconds']:>9.3f} s" +
+              (f" {stats['peak_mib']:>9.1f} MiB" if "peak_mib" in stats else ""))
+        return result
+
+    clean = record("clean_gps", clean_gps, raw, max_accuracy=MAX_ACCURACY, rows_in=len(raw))
+    results["clean_gps"]["rows_out"] = len(clean)
+    del raw
+
+    dropped = {}
+    clean = record("filter_trajectory", filter_trajectory, clean, stats=dropped, rows_in=len(clean),
+                   **TRAJECTORY_FILTER)
+    results["filter_trajectory"].update(rows_out=len(clean), dropped=dropped)
+
+    clustered, _ = record("cluster_locations_per_month", cluster_locations_per_month, clean,
+                          rows_in=len(clean), **CLUSTER_PARAMS)
+    results["cluster_locations_per_month"]["clusters"] = len(point_counts(clustered)["clusters"])
+    del clean
+
+    facts = record("build_dwell_facts", build_dwell_facts, clustered, rows_in=len(clustered))
+    visits = record("segment_visits", segment_visits, clustered, rows_in=len(clustered))
+    centroids = record("cluster_centroids", cluster_centroids, clustered, rows_in=len(clustered))
+    extents = record("cluster_extents", cluster_extents, clustered, rows_in=len(clustered))
+    places = record("link_places", link_places, extents, link_meters=CLUSTER_PARAMS["eps_meters"],
+                    rows_in=len(extents))
+    results["link_places"]["places"] = int(places["place"].nunique())
+    facts = attach_places(facts, places)
+    visits = attach_places(visits, places)
+    transitions = record("movement_transitions", movement_transitions, visits=visits, rows_in=len(visits))
+    top5 = record("top_locations_monthly", top_locations_monthly, facts=facts, n=5, rows_in=len(facts))
+    week, weekend = record("weekday_weekend_stats", weekday_weekend_stats, facts=facts, rows_in=len(facts))
+
+    counts = point_counts(clustered)
+    report = build_user_report("bench", top5, week.head(5), weekend.head(5), transitions, {
+        "total_points": counts["total_points"],
+        "non_noise": counts["total_points"] - counts["noise"],
+        "noise": counts["noise"],
+        "n_clusters": len(counts["clusters"]),
+        "n_places": results["link_places"]["places"],
+        "top_overall": place_hours(facts).head(5)["place"].tolist(),
+    })
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for render in ("canvas", "bins"):
+            record(f"make_maps_for_user[{render}]", make_maps_for_user, "bench", clustered,
+                   centroids=centroids, output_dir=tmp, render=render, rows_in=len(clustered))
+        report_file = os.path.join(tmp, "bench_report.json")
+        with open(report_file, "w", encoding="utf-8") as f:
+            json.dump(report, f)
+        record("plot_user_combined", plot_user_combined, report_file, tmp)
+
+        # assigning the clustered fixes back through the place index: batch and one at a time
+        record("build_place_indexes", lambda: build_place_indexes(
+            "bench", iter_month_frames(clustered), tmp, max_distance_m=CLUSTER_PARAMS["eps_meters"]),
+            rows_in=len(clustered))
+        assigner = PlaceAssigner("bench", tmp)
+        record("PlaceAssigner.assign", assigner.assign, clustered["datetime"], clustered["latitude"],
+               clustered["longitude"], rows_in=len(clustered))
+        single = clustered.iloc[:ASSIGN_ONE_FIXES]
+        fixes = list(zip(single["datetime"], single["latitude"].astype(float), single["longitude"].astype(float)))
+        record("PlaceAssigner.assign_one", lambda: [assigner.assign_one(*fix) for fix in fixes],
+               rows_in=len(fixes))
+        for step in ("PlaceAssigner.assign", "PlaceAssigner.assign_one"):
+            stats = results[step]
+            stats["fixes_per_s"] = round(stats["rows_in"] / stats["seconds"]) if stats["seconds"] else None
+    return results
+
+
+def _git(*args):
+    return subprocess.run(["git", *args], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+
+
+def _git_commit():
+    """Short HEAD hash, suffixed '-dirty' when tracked files differ from it."""
+    try:
+        commit = _git("rev-parse", "--short", "HEAD")
+        return commit + "-dirty" if _git("status", "--porcelain", "--untracked-files=no") else commit
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(sizes=tuple(SIZES), seed=0, memory=True, out=RESULTS_FILE):
+    meta = {
+        "commit": _git_commit(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "seed": seed,
+        "memory_pass": memory,
+    }
+    results = {}
+    for size in sizes:
+        print(f"{size} points")
+        results[size] = bench_size(SIZES[size], seed=seed, memory=memory)
+
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump({"meta": meta, "params": {"max_accuracy": MAX_ACCURACY, "filter": TRAJECTORY_FILTER,
+                                           "cluster": CLUSTER_PARAMS},
+                   "results": results}, f, indent=1, sort_keys=True)
+        f.write("\n")
+    print(f"Results written to {out}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--sizes", default=",".join(SIZES),
+                        help=f"comma-separated subset of {', '.join(SIZES)}")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--no-memory", action="store_true", help="skip the tracemalloc pass")
+    parser.add_argument("--out", default=RESULTS_FILE)
+    args = parser.parse_args()
+
+    sizes = [s.strip() for s in args.sizes.split(",") if s.strip()]
+    unknown = set(sizes) - set(SIZES)
+    if unknown:
+        parser.error(f"unknown sizes: {sorted(unknown)}")
+    run(sizes, seed=args.seed, memory=not args.no_memory, out=args.out)
@@ -0,0 +1,77 @@
+# benchmarks/synthetic.py
+import numpy as np
+import pandas as pd
+
+METERS_PER_DEG_LAT = 111320.0
+CENTER = (46.73, -117.17)
+
+
+def _offset(rng, origin, max_meters, size=None):
+    """Random points within max_meters of origin, as (lat, lon) degrees."""
+    dist = rng.uniform(0, max_meters, size)
+    angle = rng.uniform(0, 2 * np.pi, size)
+    lat = origin[0] + dist * np.cos(angle) / METERS_PER_DEG_LAT
+    lon = origin[1] + dist * np.sin(angle) / (METERS_PER_DEG_LAT * np.cos(np.radians(origin[0])))
+    return np.column_stack([lat, lon]) if size is not None else np.array([lat, lon])
+
+
+def synthetic_trajectory(n_points, days=180, seed=0, start="2024-01-01", n_errands=6,
+                         errand_rate=0.4, noise_fraction=0.02, bad_accuracy_fraction=0.05):
+    """
+    A seeded raw GPS log for one made-up person, shaped like the source CSVs
+    (datetime text, latitude, longitude, accuracy) and ready for clean_gps.
+
+    Fixes are spread irregularly over `days`. Nights (22:00-7:00) are spent at
+    home, weekdays 9:00-17:00 at work with an hour of commuting either side,
+    and the rest of the day is split into 2-hour blocks spent at one of
+    `n_errands` places with probability `errand_rate`, else at home. Every fix
+    is jittered by its accuracy (lognormal around 10 m); `bad_accuracy_fraction`
+    of fixes get accuracies the cleaner drops and `noise_fraction` are
+    replaced by spurious positions up to 20 km away.
+    """
+    rng = np.random.default_rng(seed)
+    home = _offset(rng, CENTER, 2000)
+    work = _offset(rng, CENTER, 5000)
+    errands = _offset(rng, CENTER, 3000, n_errands)
+
+    seconds = np.sort(rng.integers(0, days * 86400, n_points))
+    day = seconds // 86400
+    hour = (seconds % 86400) / 3600
+    weekday = (pd.Timestamp(start).dayofweek + day) % 7 < 5
+
+    # where each 2-hour block of the day is spent when not at home or work
+    block = day * 12 + (hour // 2).astype(np.int64)
+    goes_out = rng.random(days * 12) < errand_rate
+    errand_of_block = rng.integers(0, n_errands, days * 12)
+
+    pos = np.broadcast_to(home, (n_points, 2)).copy()
+    awake = (hour >= 7) & (hour < 22)
+    out = awake & goes_out[block]
+    pos[out] = errands[errand_of_block[block[out]]]
+
+    at_work = weekday & (hour >= 9) & (hour < 17)
+    pos[at_work] = work
+    to_work = weekday & (hour >= 8) & (hour < 9)
+    pos[to_work] = home + np.outer(hour[to_work] - 8, work - home)
+    to_home = weekday & (hour >= 17) & (hour < 18)
+    pos[to_home] = work + np.outer(hour[to_home] - 17, home - work)
+
+    accuracy = rng.lognormal(np.log(10), 0.5, n_points)
+    bad = rng.random(n_points) < bad_accuracy_fraction
+    accuracy[bad] = rng.uniform(60, 500, bad.sum())
+
+    # jitter of roughly the reported accuracy
+    jitter = rng.normal(0, 1, (n_points, 2)) * (accuracy / 2)[:, None] / METERS_PER_DEG_LAT
+    jitter[:, 1] /= np.cos(np.radians(CENTER[0]))
+    pos += jitter
+
+    noise = rng.random(n_points) < noise_fraction
+    pos[noise] = _offset(rng, CENTER, 20000, noise.sum())
+
+    times = np.datetime64(pd.Timestamp(start).to_datetime64(), "s") + seconds.astype("timedelta64[s]")
+    return pd.DataFrame({
+        "datetime": np.datetime_as_string(times, unit="s"),
+        "latitude": pos[:, 0],
+        "longitude": pos[:, 1],
+        "accuracy": np.round(accuracy, 1),
+    })
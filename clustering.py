@@ -1,80 +1,407 @@
 # clustering.py
+import os
 import pandas as pd
 import numpy as np
-import kDBCV
 from sklearn.cluster import DBSCAN
 import hdbscan
 import warnings
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from evaluation import EVAL_MODES, evaluation_sample, dbcv_score
+from data_load import month_codes, month_label, EARTH_RADIUS_M
+from instrumentation import measure_call, worker_initializer
 
-def cluster_locations_per_month(df, eps_meters=50, min_samples=5, n_jobs=1):
+# month code of 1970-01, so code - EPOCH_MONTH is the pandas Period ordinal
+EPOCH_MONTH = 1970 * 12
+
+def resolve_workers(n_jobs, n_tasks):
+    """Turn an sklearn-style n_jobs value into a worker count (-1 = all cores)."""
+    cpus = os.cpu_count() or 1
+    if n_jobs is None or n_jobs == 0:
+        n_jobs = 1
+    elif n_jobs < 0:
+        n_jobs = max(1, cpus + 1 + n_jobs)
+    return max(1, min(n_jobs, n_tasks))
+
+
+def preaggregate_grid(coords, cell_meters, min_samples):
+    """
+    Collapse coordinates (radians) onto a fine square grid before clustering.
+
+    Returns (reduced, inverse, n_cells): `reduced` holds the mean position of
+    each occupied cell, repeated min(count, min_samples) times so a busy cell
+    still looks dense to HDBSCAN; `inverse[i]` is the first row in `reduced`
+    for original point i, used to copy labels back.
+
+    The repeat cap discards each cell's weight beyond min_samples, so cluster
+    boundaries can differ from clustering the raw points (nearby busy cells
+    may merge); compare the labels before relying on it.
+    """
+    lat0 = float(np.mean(coords[:, 0]))
+    rows = np.floor(coords[:, 0] * EARTH_RADIUS_M / cell_meters).astype(np.int64)
+    cols = np.floor(coords[:, 1] * EARTH_RADIUS_M * np.cos(lat0) / cell_meters).astype(np.int64)
+
+    cells, cell_of_point, counts = np.unique(
+        np.stack([rows, cols], axis=1), axis=0, return_inverse=True, return_counts=True
+    )
+    cell_of_point = cell_of_point.ravel()
+    n_cells = len(cells)
+
+    centers = np.empty((n_cells, 2), dtype=coords.dtype)
+    centers[:, 0] = np.bincount(cell_of_point, weights=coords[:, 0], minlength=n_cells) / counts
+    centers[:, 1] = np.bincount(cell_of_point, weights=coords[:, 1], minlength=n_cells) / counts
+
+    repeats = np.minimum(counts, min_samples)
+    reduced = np.repeat(centers, repeats, axis=0)
+    first_row = np.concatenate([[0], np.cumsum(repeats)[:-1]])
+    return reduced, first_row[cell_of_point], n_cells
+
+
+def project_to_meters(coords):
     """
-    Cluster all locations grouped by month in parallel using DBSCAN with Haversine metric.
+    Project coordinates (radians) to a local equirectangular frame in meters,
+    centred on the mean position. Accurate to well under a meter at city scale.
+    """
+    lat0 = float(np.mean(coords[:, 0]))
+    lon0 = float(np.mean(coords[:, 1]))
+    xy = np.empty(coords.shape, dtype=np.float64)
+    xy[:, 0] = (coords[:, 1] - lon0) * np.cos(lat0) * EARTH_RADIUS_M
+    xy[:, 1] = (coords[:, 0] - lat0) * EARTH_RADIUS_M
+    return xy
+
+
+def _make_hdbscan(eps_meters, min_samples, metric="haversine", **kwargs):
+    """HDBSCAN configured for radians ('haversine') or local meters ('projected')."""
+    if metric == "haversine":
+        return hdbscan.HDBSCAN(
+            min_cluster_size=min_samples,
+            min_samples=min_samples,
+            metric="haversine",
+            cluster_selection_epsilon=eps_meters/EARTH_RADIUS_M,
+            **kwargs
+        )
+    if metric == "projected":
+        # euclidean in meters lets HDBSCAN use the Boruvka KD-tree algorithm
+        return hdbscan.HDBSCAN(
+            min_cluster_size=min_samples,
+            min_samples=min_samples,
+            metric="euclidean",
+            algorithm="boruvka_kdtree",
+            cluster_selection_epsilon=float(eps_meters),
+            **kwargs
+        )
+    raise ValueError(f"Unknown metric mode: {metric!r} (use 'haversine' or 'projected')")
+
+
+def _cluster_month(coords, eps_meters, min_samples, cell_meters=None, metric="haversine",
+                   eval_mode="sampled", eval_max_points=5000, eval_seed=0):
+    """
+    Cluster one month of coordinates (radians).
+    Runs inside a worker process, so it only receives the coordinate array.
+    Returns (labels, eval_sample, n_clustered); eval_sample is the small
+    (coords, labels) set DBCV should be scored on, or None if evaluation is off.
+    """
+    warnings.filterwarnings("ignore", message=".*force_all_finite.*")
+
+    inverse = None
+    if cell_meters:
+        coords, inverse, _ = preaggregate_grid(coords, cell_meters, min_samples)
+    if metric == "projected":
+        coords = project_to_meters(coords)
+
+    # HDBSCAN clustering
+    db = _make_hdbscan(eps_meters, min_samples, metric)
+    labels = db.fit_predict(coords)
+
+    # only a capped, stratified sample leaves the worker for DBCV
+    sample = evaluation_sample(coords, labels, eval_mode, eval_max_points, eval_seed)
+
+    n_clustered = len(coords)
+    if inverse is not None:
+        labels = labels[inverse]
+    return labels, sample, n_clustered
+
+
+def cluster_locations_per_month(df, eps_meters=50, min_samples=5, n_jobs=1, cell_meters=None,
+                                metric="haversine", eval_mode="sampled", eval_max_points=5000,
+                                eval_seed=0, eval_jobs=1, month_stats=None):
+    """
+    Cluster all locations grouped by month in parallel using HDBSCAN.
 
     Parameters:
     - df: DataFrame with 'datetime', 'latitude', 'longitude'
     - eps_meters: clustering radius in meters
     - min_samples: minimum points for a cluster
-    - n_jobs: parallel jobs for DBSCAN
+    - n_jobs: worker processes for the month groups (1 = serial, -1 = all cores)
+    - cell_meters: if set, pre-aggregate points onto a grid of this size before
+      HDBSCAN and copy the labels back to the original rows (approximate, see
+      preaggregate_grid; None clusters the raw points)
+    - metric: 'haversine' (radians, ball tree) or 'projected' (each month in a
+      local meter frame, euclidean KD-tree; eps_meters is used directly)
+    - eval_mode: DBCV evaluation 'off', 'sampled' (stratified by cluster, at
+      most eval_max_points) or 'full'
+    - eval_seed: base seed for the DBCV sample, combined with the month
+    - eval_jobs: processes scoring DBCV alongside clustering (0 = inline)
+    - month_stats: optional list; one dict per month is appended with the
+      month, points in/clustered/non-noise, the DBCV score and the wall/CPU
+      seconds and peak RSS (and tracemalloc peak while tracing) of the HDBSCAN
+      fit (pre-aggregation and DBCV sampling included) and of the DBCV scoring
+
+    Returns (clustered DataFrame, average DBCV score or None).
     """
     warnings.filterwarnings("ignore", message=".*force_all_finite.*")
-    df = df.copy()
-    df['datetime'] = pd.to_datetime(df['datetime'])
-    df['month'] = df['datetime'].dt.to_period('M')
+    if eval_mode not in EVAL_MODES:
+        raise ValueError(f"Unknown evaluation mode: {eval_mode!r} (use one of {EVAL_MODES})")
+    if not pd.api.types.is_datetime64_any_dtype(df['datetime']):
+        df = df.assign(datetime=pd.to_datetime(df['datetime']))
+    codes = month_codes(df['datetime'])
 
-    result_dfs = []
-    evaluation_scores = []
-    count = 0
-    evaluated = 0
+    # row positions of every month, in month order
+    order = np.argsort(codes, kind="stable")
+    months, starts = np.unique(codes[order], return_index=True)
+    month_positions = list(zip(months.tolist(), np.split(order, starts[1:])))
+    if not month_positions:
+        raise ValueError("No rows to cluster")
 
-    for month, group in df.groupby('month'):
-        if group.empty:
-            continue
+    # Convert coordinates to radians for Haversine metric
+    all_coords = np.radians(df[['latitude', 'longitude']].to_numpy(dtype=np.float32))
 
-        # Convert coordinates to radians for Haversine metric
-        coords = np.radians(group[['latitude', 'longitude']].to_numpy(dtype=np.float32))
+    def month_args(month, pos):
+        return (all_coords[pos], eps_meters, min_samples, cell_meters, metric,
+                eval_mode, eval_max_points, eval_seed + month - EPOCH_MONTH)
 
+    results = {}
+    scores = {}
+    fit_stats = {}
+    count = 0
+    n_workers = resolve_workers(n_jobs, len(month_positions))
+    eval_pool = None
+    if eval_mode != "off" and eval_jobs:
+        eval_pool = ProcessPoolExecutor(max_workers=eval_jobs, initializer=worker_initializer())
 
-        # HDBSCAN clustering
-        db = hdbscan.HDBSCAN(
-            min_cluster_size=min_samples,
-            min_samples=min_samples,
-            metric="haversine",
-            cluster_selection_epsilon=eps_meters/6371000
-        )
-        labels = db.fit_predict(coords)
+    def collect(month, timed):
+        # DBCV for this month runs while the next months are still clustering
+        result, fit_stats[month] = timed
+        labels, sample, _ = result
+        results[month] = result
+        if sample is None:
+            return
+        if eval_pool is not None:
+            scores[month] = eval_pool.submit(measure_call, dbcv_score, *sample)
+        else:
+            scores[month] = measure_call(dbcv_score, *sample)
 
-        #Evaluate the clustering method using 20% of the data as a sample
-        sample_size = int(0.2 * len(coords))
-        indices = np.random.choice(len(coords), size=sample_size, replace=False)
-        sampled_coords = coords[indices].astype(np.float32)
-        sampled_labels = labels[indices]
+    try:
+        if n_workers == 1:
+            for month, pos in month_positions:
+                collect(month, measure_call(_cluster_month, *month_args(month, pos)))
+                count += 1
+                print(f"finished {count}")
+        else:
+            with ProcessPoolExecutor(max_workers=n_workers, initializer=worker_initializer()) as pool:
+                # largest months first so a big month doesn't start last
+                futures = {
+                    pool.submit(measure_call, _cluster_month, *month_args(month, pos)): month
+                    for month, pos in sorted(month_positions, key=lambda mp: -len(mp[1]))
+                }
+                for fut in as_completed(futures):
+                    collect(futures[fut], fut.result())
+                    count += 1
+                    print(f"finished {count}")
+        scores = {
+            month: score.result() if eval_pool is not None else score
+            for month, score in scores.items()
+        }
+    finally:
+        if eval_pool is not None:
+            eval_pool.shutdown()
 
-        #handles if HDSCAN was unable to create clusters or kDBCV is unable to produce an analysis
-        try:
-            score = kDBCV.DBCV_score(sampled_coords, sampled_labels, mem_cutoff=7)
-        except ValueError:
-            score = (-1,0)
+    # Reassemble labels in month order
+    evaluation_scores = []
+    n_clustered = 0
+    labels = np.full(len(df), -1, dtype=np.int32)
+    for month, pos in month_positions:
+        month_labels, _, month_clustered = results[month]
+        labels[pos] = month_labels
+        n_clustered += month_clustered
 
+        score, dbcv_stats = scores.get(month, (None, None))
         #only stores and tracks succesfull evaluation
-        if score[0] != -1:
-            evaluation_scores.append(score[0])
-            evaluated +=1
-        else:
-            print("Score not appended (-1)")
+        if month in scores:
+            if score is not None:
+                evaluation_scores.append(score)
+            else:
+                print(f"{month_label(month)}: DBCV score not appended (-1)")
 
+        if month_stats is not None:
+            month_stats.append({
+                "month": month_label(month),
+                "points_in": len(pos),
+                "points_clustered": int(month_clustered),
+                "points_out": int((month_labels != -1).sum()),
+                "dbcv": score,
+                "fit": fit_stats[month],
+                "dbcv_time": dbcv_stats,
+            })
 
-        count += 1
+    if cell_meters:
+        print(
+            f"Pre-aggregation ({cell_meters} m cells): {len(df)} -> {n_clustered} points "
+            f"clustered ({len(df) / max(n_clustered, 1):.1f}x reduction)"
+        )
 
-        print(f"finished {count}")
-        group = group.copy()
-        group['cluster'] = labels
-        result_dfs.append(group)
+    # the only copy of the points: rows in month order plus the two new columns
+    result_df = df.iloc[order].reset_index(drop=True)
+    result_df['month'] = codes[order]
+    result_df['cluster'] = labels[order]
 
     #find average DBCV score
     print(evaluation_scores)
-    avg_DBCV_score = sum(evaluation_scores) / evaluated
+    avg_DBCV_score = sum(evaluation_scores) / len(evaluation_scores) if evaluation_scores else None
+
+    return result_df, avg_DBCV_score
+
+
+def _sweep_month(coords, min_samples, min_cluster_sizes, eps_grid, metric, cell_meters,
+                 dbcv_sample_size, seed):
+    """
+    Fit HDBSCAN once for one month and min_samples, then re-select flat
+    clusterings from the same hierarchy for every (min_cluster_size, eps).
+    Returns a list of per-setting dicts for this month.
+    """
+    from hdbscan._hdbscan_tree import condense_tree, compute_stability, get_clusters
+
+    warnings.filterwarnings("ignore", message=".*force_all_finite.*")
+    inverse = slice(None)
+    if cell_meters:
+        coords, inverse, _ = preaggregate_grid(coords, cell_meters, min_samples)
+    if metric == "projected":
+        coords = project_to_meters(coords)
+    # distances in the tree are radians for haversine, meters when projected
+    eps_scale = 1.0 if metric == "projected" else 1.0 / EARTH_RADIUS_M
+
+    # the single linkage tree (MST) depends on min_samples only
+    db = _make_hdbscan(0, min_samples, metric).fit(coords)
+    linkage = db.single_linkage_tree_.to_numpy()
+
+    rows = []
+    for mcs in min_cluster_sizes:
+        condensed = condense_tree(linkage, mcs)
+        stability = compute_stability(condensed)
+        for eps in eps_grid:
+            # get_clusters edits the stability dict in place, so hand it a copy
+            labels, _, _ = get_clusters(
+                condensed, dict(stability), "eom", False, False, eps * eps_scale
+            )
+            point_labels = labels[inverse]
+
+            score = None
+            if dbcv_sample_size:
+                score = dbcv_score(*evaluation_sample(coords, labels, "sampled", dbcv_sample_size, seed))
+
+            rows.append({
+                "min_samples": min_samples,
+                "min_cluster_size": mcs,
+                "eps_meters": eps,
+                "points": len(point_labels),
+                "clusters": len(set(labels.tolist()) - {-1}),
+                "noise_points": int(np.sum(point_labels == -1)),
+                "dbcv": np.nan if score is None else score,
+            })
+    return rows
+
+
+def sweep_cluster_params(df, eps_grid=(25, 50, 100), min_samples_grid=(5,),
+                         min_cluster_size_grid=None, n_jobs=1, cell_meters=None,
+                         metric="haversine", dbcv_sample_size=2000, seed=0):
+    """
+    Evaluate a grid of clustering settings without refitting HDBSCAN per setting.
+
+    The hierarchy is built once per (month, min_samples); every
+    min_cluster_size / eps_meters pair is then selected from it. Returns one
+    row per setting with the cluster count summed over months, the noise
+    fraction and the mean DBCV on a seeded, stratified sample of at most
+    dbcv_sample_size points (0 skips DBCV).
+    min_cluster_size_grid defaults to min_samples, as in cluster_locations_per_month.
+    """
+    df = df.copy()
+    df['datetime'] = pd.to_datetime(df['datetime'])
+    df['month'] = df['datetime'].dt.to_period('M')
+    coords = np.radians(df[['latitude', 'longitude']].to_numpy(dtype=np.float32))
+    month_positions = sorted(df.groupby('month').indices.items())
+
+    tasks = []
+    for ms in min_samples_grid:
+        sizes = list(min_cluster_size_grid) if min_cluster_size_grid else [ms]
+        for month, pos in month_positions:
+            tasks.append((coords[pos], ms, sizes, list(eps_grid), metric, cell_meters,
+                          dbcv_sample_size, seed))
+
+    rows = []
+    n_workers = resolve_workers(n_jobs, len(tasks))
+    if n_workers == 1:
+        for task in tasks:
+            rows.extend(_sweep_month(*task))
+    else:
+        with ProcessPoolExecutor(max_workers=n_workers) as pool:
+            for month_rows in pool.map(_sweep_month, *zip(*tasks)):
+                rows.extend(month_rows)
+
+    per_month = pd.DataFrame(rows)
+    keys = ["min_samples", "min_cluster_size", "eps_meters"]
+    table = per_month.groupby(keys).agg(
+        clusters=("clusters", "sum"),
+        points=("points", "sum"),
+        noise_points=("noise_points", "sum"),
+        dbcv=("dbcv", "mean"),
+    ).reset_index()
+    table["noise_fraction"] = table["noise_points"] / table["points"]
+    return table[keys + ["clusters", "noise_fraction", "dbcv"]]
+
+
+def compare_metric_modes(df, eps_meters=50, min_samples=5, cell_meters=None):
+    """
+    Validate the projected fast path: cluster every month with both metric
+    modes and report how closely the labels agree.
+
+    Returns one row per month with the adjusted Rand index, the fraction of
+    points whose noise/non-noise status matches, cluster counts and fit times.
+    """
+    from sklearn.metrics import adjusted_rand_score
+    import time
+
+    warnings.filterwarnings("ignore", message=".*force_all_finite.*")
+    df = df.copy()
+    df['datetime'] = pd.to_datetime(df['datetime'])
+    df['month'] = df['datetime'].dt.to_period('M')
+
+    rows = []
+    for month, group in df.groupby('month'):
+        coords = np.radians(group[['latitude', 'longitude']].to_numpy(dtype=np.float32))
+        if cell_meters:
+            coords, inverse, _ = preaggregate_grid(coords, cell_meters, min_samples)
+        else:
+            inverse = slice(None)
+
+        labels = {}
+        seconds = {}
+        for mode in ("haversine", "projected"):
+            X = project_to_meters(coords) if mode == "projected" else coords
+            start = time.perf_counter()
+            labels[mode] = _make_hdbscan(eps_meters, min_samples, mode).fit_predict(X)[inverse]
+            seconds[mode] = time.perf_counter() - start
 
-    return pd.concat(result_dfs, ignore_index=True), avg_DBCV_score
+        hav, proj = labels["haversine"], labels["projected"]
+        rows.append({
+            "month": str(month),
+            "points": len(group),
+            "ari": adjusted_rand_score(hav, proj),
+            "noise_agreement": float(np.mean((hav == -1) == (proj == -1))),
+            "clusters_haversine": len(set(hav) - {-1}),
+            "clusters_projected": len(set(proj) - {-1}),
+            "seconds_haversine": seconds["haversine"],
+            "seconds_projected": seconds["projected"],
+        })
+    return pd.DataFrame(rows)
 
 
 def compute_time_spent(df):
@@ -82,9 +409,7 @@ def compute_time_spent(df):
     Compute time spent per cluster in hours.
     Assumes 'datetime' is sorted.
     """
-    df_mod = df.copy()
-    df_mod['time_diff'] = df_mod['datetime'].diff().dt.total_seconds().fillna(0) / 3600  # hours
-    time_per_cluster = df_mod.groupby('cluster')['time_diff'].sum().reset_index()
-    time_per_cluster.rename(columns={'time_diff': 'hours'}, inplace=True)
+    time_diff = df['datetime'].diff().dt.total_seconds().fillna(0) / 3600  # hours
+    time_per_cluster = time_diff.groupby(df['cluster']).sum().rename('hours').reset_index()
     time_per_cluster = time_per_cluster.sort_values(by = ['hours'], ascending=False)
     return time_per_cluster
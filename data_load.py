@@ -1,9 +1,51 @@
 # data_load.py
+import numpy as np
 import pandas as pd
 import glob
 import os
 
 DATA_PATH = r"C:\Users\clara\Washington State University (email.wsu.edu)\Oje, Funso - locations"
+CACHE_DIR = "clean_cache"
+
+# columns kept by the streaming reader, with the compact dtypes they are read as
+GPS_DTYPES = {"latitude": "float32", "longitude": "float32", "accuracy": "float32"}
+
+# in-memory layout of a point frame once it leaves the reader or the disk:
+# whole-second timestamps (int64 epoch seconds underneath), float32 coordinates,
+# int32 cluster labels and an int32 month code instead of a Period/str column
+POINT_DTYPES = {"datetime": "datetime64[s]", **GPS_DTYPES, "cluster": "int32", "month": "int32"}
+
+EARTH_RADIUS_M = 6371000
+
+
+def month_codes(dt):
+    """Integer month code (year * 12 + month - 1) for a datetime Series."""
+    return (dt.dt.year.to_numpy() * 12 + dt.dt.month.to_numpy() - 1).astype(np.int32)
+
+
+def month_label(code):
+    """'YYYY-MM' for a month code."""
+    return f"{code // 12:04d}-{code % 12 + 1:02d}"
+
+
+def month_code_of(label):
+    """Month code for a 'YYYY-MM' label."""
+    year, month = label.split("-")
+    return int(year) * 12 + int(month) - 1
+
+
+def compact_points(df):
+    """
+    Cast a point frame to POINT_DTYPES in place of whatever the CSV reader or
+    an older artifact produced. A non-integer 'month' (Period or text) is
+    rebuilt from datetime as a month code; absent columns stay absent.
+    """
+    if not pd.api.types.is_datetime64_any_dtype(df["datetime"]):
+        df = df.assign(datetime=pd.to_datetime(df["datetime"]))
+    dtypes = {c: t for c, t in POINT_DTYPES.items() if c in df.columns}
+    if "month" in df.columns and not pd.api.types.is_integer_dtype(df["month"]):
+        df = df.assign(month=month_codes(df["datetime"]))
+    return df.astype(dtypes)
 
 def load_all_csvs(path=DATA_PATH):
     csv_files = glob.glob(os.path.join(path, "*.csv"))
@@ -22,16 +64,87 @@ def load_all_csvs(path=DATA_PATH):
     return dfs
 
 
-def clean_gps(df, max_accuracy=50):
-    df = df.copy()
-    df.columns = [c.lower().strip() for c in df.columns]
-    df["datetime"] = pd.to_datetime(df["datetime"], errors="coerce")
-    df = df[df["accuracy"] <= max_accuracy]
-    df = df.dropna(subset=["datetime", "latitude", "longitude"])
-    df = df.sort_values("datetime").reset_index(drop=True)
+def haversine_m(lat1, lon1, lat2, lon2):
+    """Great-circle distance in meters between arrays of points in degrees."""
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(a, dtype=np.float64)) for a in (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+# ------------ TRAJECTORY FILTER ------------
+def _step_lengths(df):
+    """
+    Meters and seconds from the previous fix for every row of a time-sorted
+    frame, plus a mask of rows that start a month (no previous fix there).
+    """
+    lat = df["latitude"].to_numpy()
+    lon = df["longitude"].to_numpy()
+    times = df["datetime"].to_numpy()
+    meters = np.zeros(len(df))
+    seconds = np.zeros(len(df))
+    meters[1:] = haversine_m(lat[:-1], lon[:-1], lat[1:], lon[1:])
+    seconds[1:] = (times[1:] - times[:-1]) / np.timedelta64(1, "s")
+
+    codes = month_codes(df["datetime"])
+    month_start = np.ones(len(df), dtype=bool)
+    month_start[1:] = codes[1:] != codes[:-1]
+    return meters, seconds, month_start
+
+
+def filter_trajectory(df, max_speed_kmh=None, dedup_meters=None, stats=None):
+    """
+    Drop jump outliers and redundant stationary fixes from a time-sorted point
+    frame; each filter is off when its parameter is None. Nothing links fixes
+    across a month boundary, so filtering month by month (as the out-of-core
+    cleaner does) keeps the same rows as filtering the whole history.
+
+    - max_speed_kmh: drop single-fix jumps, fixes reached from the previous
+      fix and left for the next one both faster than this. Fixes sharing a
+      timestamp count as one second apart.
+    - dedup_meters: in a stationary run (each fix within this distance of the
+      one before; 0 = identical coordinates) drop the fixes whose next fix is
+      in the same run and the same clock hour. Dwell is measured since the
+      previous fix, so the next kept fix then carries the dropped fixes' time
+      and dwell per (month, weekday/weekend, hour) is unchanged.
+
+    `stats`, if given, is filled with rows dropped per filter
+    ({"speed": n, "duplicates": n}).
+    """
+    counts = {}
+    if max_speed_kmh is not None and len(df) > 2:
+        meters, seconds, month_start = _step_lengths(df)
+        fast = ~month_start & (meters / np.maximum(seconds, 1) * 3.6 > max_speed_kmh)
+        spike = np.zeros(len(df), dtype=bool)
+        spike[:-1] = fast[:-1] & fast[1:]
+        counts["speed"] = int(spike.sum())
+        if spike.any():
+            df = df[~spike].reset_index(drop=True)
+
+    if dedup_meters is not None and len(df) > 2:
+        meters, _, month_start = _step_lengths(df)
+        repeat = ~month_start & (meters <= dedup_meters)
+        hour = df["datetime"].to_numpy().astype("datetime64[h]")
+        redundant = np.zeros(len(df), dtype=bool)
+        redundant[:-1] = repeat[:-1] & repeat[1:] & (hour[:-1] == hour[1:])
+        counts["duplicates"] = int(redundant.sum())
+        if redundant.any():
+            df = df[~redundant].reset_index(drop=True)
+
+    if stats is not None:
+        stats.update(counts)
     return df
 
-def clean_gps(df, max_accuracy=50):
+
+def _describe_filter(counts, max_speed_kmh, dedup_meters):
+    parts = []
+    if "speed" in counts:
+        parts.append(f"-{counts['speed']} speed > {max_speed_kmh} km/h")
+    if "duplicates" in counts:
+        parts.append(f"-{counts['duplicates']} duplicates within {dedup_meters} m")
+    return ", ".join(parts)
+
+
+def clean_gps(df, max_accuracy=50, max_speed_kmh=None, dedup_meters=None, stats=None):
 
     df = df.copy()
     df.columns = [c.lower().strip() for c in df.columns]
@@ -52,11 +165,75 @@ def clean_gps(df, max_accuracy=50):
     # Sort by time
     df = df.sort_values("datetime").reset_index(drop=True)
 
+    # Trajectory filters (speed jumps, stationary duplicates)
+    counts = {}
+    df = filter_trajectory(df, max_speed_kmh, dedup_meters, counts)
+    if stats is not None:
+        stats.update(counts)
+
     print(
         f"Clean GPS: {original_rows} -> {after_parse} (parsed datetime) -> "
         f"{after_accuracy} (accuracy <= {max_accuracy}) -> "
         f"{after_dropna} (after dropna)"
+        + (f" -> {len(df)} ({_describe_filter(counts, max_speed_kmh, dedup_meters)})" if counts else "")
     )
 
     return df
 
+
+# ------------ STREAMING READER ------------
+def iter_gps_chunks(file, max_accuracy=50, chunksize=500_000, datetime_format="ISO8601"):
+    """
+    Stream one raw CSV as cleaned chunks: yields (raw rows, cleaned chunk).
+
+    Only datetime/latitude/longitude/accuracy are read, with float32 coordinates
+    and a fixed-format datetime parse; the accuracy filter and dropna run per
+    chunk. Chunks come in file order and are not sorted.
+    """
+    # map the file's own header spelling onto the lower-case names clean_gps uses
+    header = pd.read_csv(file, nrows=0).columns
+    rename = {c: c.lower().strip() for c in header}
+    usecols = [c for c in header if rename[c] in ("datetime", *GPS_DTYPES)]
+    dtypes = {c: GPS_DTYPES[rename[c]] for c in usecols if rename[c] in GPS_DTYPES}
+
+    for chunk in pd.read_csv(file, usecols=usecols, dtype=dtypes, chunksize=chunksize):
+        chunk = chunk.rename(columns=rename)
+        raw_rows = len(chunk)
+
+        chunk["datetime"] = pd.to_datetime(chunk["datetime"], format=datetime_format, errors="coerce")
+        chunk = chunk[chunk["accuracy"] <= max_accuracy]
+        chunk = chunk.dropna(subset=["datetime", "latitude", "longitude"])
+        yield raw_rows, chunk
+
+
+def read_gps_csv(file, max_accuracy=50, chunksize=500_000, datetime_format="ISO8601",
+                 max_speed_kmh=None, dedup_meters=None, stats=None):
+    """
+    Read one raw CSV in chunks and clean it on the fly (see iter_gps_chunks),
+    so only surviving rows are kept in memory. The trajectory filters
+    (see filter_trajectory) run once the rows are in time order.
+    """
+    original_rows = 0
+    kept = []
+    for raw_rows, chunk in iter_gps_chunks(file, max_accuracy, chunksize, datetime_format):
+        original_rows += raw_rows
+        kept.append(chunk)
+
+    if kept:
+        df = pd.concat(kept, ignore_index=True)
+    else:
+        df = pd.DataFrame({c: pd.Series(dtype=POINT_DTYPES[c]) for c in ("datetime", *GPS_DTYPES)})
+    df = compact_points(df.sort_values("datetime", kind="stable").reset_index(drop=True))
+    after_dropna = len(df)
+
+    counts = {}
+    df = filter_trajectory(df, max_speed_kmh, dedup_meters, counts)
+    if stats is not None:
+        stats.update(counts)
+
+    print(
+        f"Read GPS: {original_rows} -> {after_dropna} "
+        f"(accuracy <= {max_accuracy}, after dropna, chunksize={chunksize})"
+        + (f" -> {len(df)} ({_describe_filter(counts, max_speed_kmh, dedup_meters)})" if counts else "")
+    )
+    return df
@@ -0,0 +1,70 @@
+# evaluation.py
+import numpy as np
+import kDBCV
+import warnings
+
+EVAL_MODES = ("off", "sampled", "full")
+
+
+def stratified_sample(labels, max_points, seed=0, min_per_cluster=2):
+    """
+    Pick at most `max_points` row indices, allocated to each label (noise
+    included) in proportion to its size, with at least `min_per_cluster`
+    rows from every label so small clusters still take part in DBCV. With
+    more labels than that floor allows, it is lowered (to 0 once there are
+    more labels than `max_points`) so the total stays within `max_points`.
+    """
+    labels = np.asarray(labels)
+    n = len(labels)
+    if n <= max_points:
+        return np.arange(n)
+
+    rng = np.random.default_rng(seed)
+    uniq, inverse, counts = np.unique(labels, return_inverse=True, return_counts=True)
+    # the floor first, then the rest of the budget in proportion to what is left
+    base = np.minimum(counts, min(min_per_cluster, max_points // len(uniq)))
+    spare = counts - base
+    share = spare * (max_points - base.sum()) / spare.sum()
+    quota = base + np.floor(share).astype(np.int64)
+    # rows lost to rounding go to the largest remainders (ties broken at random)
+    short = max_points - quota.sum()
+    quota[np.lexsort((rng.random(len(uniq)), -(share % 1)))[:short]] += 1
+
+    # group row indices by label, then take a random slice of each group
+    order = np.argsort(inverse, kind="stable")
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    picked = [
+        rng.choice(order[start:start + count], size=q, replace=False)
+        for start, count, q in zip(starts, counts, quota)
+    ]
+    return np.sort(np.concatenate(picked))
+
+
+def evaluation_sample(coords, labels, mode="sampled", max_points=5000, seed=0):
+    """
+    Return the (coords, labels) that DBCV should be computed on for `mode`,
+    or None when evaluation is off.
+    """
+    if mode not in EVAL_MODES:
+        raise ValueError(f"Unknown evaluation mode: {mode!r} (use one of {EVAL_MODES})")
+    if mode == "off":
+        return None
+    if mode == "full":
+        return np.asarray(coords, dtype=np.float32), np.asarray(labels)
+    idx = stratified_sample(labels, max_points, seed)
+    return np.asarray(coords[idx], dtype=np.float32), np.asarray(labels)[idx]
+
+
+def dbcv_score(coords, labels):
+    """
+    DBCV of a labelled sample, or None if kDBCV cannot score it
+    (e.g. HDBSCAN found no clusters).
+    """
+    warnings.filterwarnings("ignore", message=".*force_all_finite.*")
+    try:
+        score = kDBCV.DBCV_score(coords, labels, mem_cutoff=7)
+    except ValueError:
+        return None
+    if score[0] == -1:
+        return None
+    return score[0]
@@ -0,0 +1,128 @@
+# incremental.py
+import os
+import json
+import hashlib
+import numpy as np
+import pandas as pd
+from clustering import cluster_locations_per_month
+from data_load import month_codes, month_label, month_code_of
+
+CLUSTERED_DIR = "clustered_outputs"
+
+
+def _manifest_path(name, cluster_dir):
+    return os.path.join(cluster_dir, f"{name}_manifest.json")
+
+
+def month_hashes(df):
+    """
+    {month: {"rows": n, "hash": sha1}} over the cleaned datetime/latitude/
+    longitude values of each month, so any added, removed or edited fix
+    changes its month's entry.
+    """
+    months = month_codes(df["datetime"])
+    row_hash = pd.util.hash_pandas_object(
+        df[["datetime", "latitude", "longitude"]], index=False
+    ).to_numpy()
+
+    out = {}
+    order = np.argsort(months, kind="stable")
+    uniq, starts = np.unique(months[order], return_index=True)
+    bounds = list(starts[1:]) + [len(order)]
+    for month, start, end in zip(uniq, starts, bounds):
+        rows = row_hash[order[start:end]]
+        out[month_label(month)] = {"rows": int(len(rows)), "hash": hashlib.sha1(rows.tobytes()).hexdigest()}
+    return out
+
+
+def load_manifest(name, cluster_dir=CLUSTERED_DIR):
+    path = _manifest_path(name, cluster_dir)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_manifest(name, manifest, cluster_dir=CLUSTERED_DIR):
+    os.makedirs(cluster_dir, exist_ok=True)
+    with open(_manifest_path(name, cluster_dir), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+
+
+def remove_manifest(name, cluster_dir=CLUSTERED_DIR):
+    """Forget the manifest once the store is rewritten elsewhere, so the next run reclusters everything."""
+    path = _manifest_path(name, cluster_dir)
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def stale_months(current, manifest, params):
+    """
+    Months whose rows differ from the manifest (or all of them if the
+    clustering parameters changed), plus months that disappeared.
+    Returns (changed, removed) as sorted lists of 'YYYY-MM' strings.
+    """
+    stored = manifest.get("months", {}) if manifest is not None else {}
+    removed = sorted(set(stored) - set(current))
+    if manifest is None or manifest.get("params") != params:
+        return sorted(current), removed
+    changed = sorted(m for m, entry in current.items() if stored.get(m) != entry)
+    return changed, removed
+
+
+def incremental_cluster(name, df, stored=None, cluster_dir=CLUSTERED_DIR, eps_meters=50,
+                        min_samples=5, n_jobs=1, cell_meters=None, metric="haversine", **eval_kwargs):
+    """
+    Recluster only the months of `df` (a cleaned frame) that are new or
+    changed since the stored manifest, and merge them into `stored` (the
+    previous clustered frame for this user, or a callable returning the
+    stored rows of a list of 'YYYY-MM' months so unchanged months are the
+    only ones read back).
+
+    Returns (clustered DataFrame, changed months, average DBCV of the
+    reclustered months or None, new manifest). Save the clustered frame
+    first and the manifest after it, so a crash in between only causes
+    extra reclustering next time.
+    """
+    new_manifest = build_manifest(df, eps_meters, min_samples, cell_meters, metric)
+    current = new_manifest["months"]
+    manifest = load_manifest(name, cluster_dir) if stored is not None else None
+    changed, removed = stale_months(current, manifest, new_manifest["params"])
+
+    def stored_rows(months):
+        if callable(stored):
+            return stored(months)
+        return stored[np.isin(month_codes(stored["datetime"]), [month_code_of(m) for m in months])]
+
+    if not changed and not removed:
+        print(f"{name}: clustering up to date ({len(current)} months)")
+        return stored_rows(sorted(current)), [], None, new_manifest
+
+    print(f"{name}: reclustering {len(changed)} of {len(current)} months"
+          + (f", dropping {len(removed)}" if removed else ""))
+
+    avg_DBCV_score = None
+    parts = []
+    if stored is not None:
+        kept = sorted(set(manifest["months"]) - set(changed) - set(removed)) if manifest else []
+        parts.append(stored_rows(kept))
+    if changed:
+        redo = [month_code_of(m) for m in changed]
+        fresh, avg_DBCV_score = cluster_locations_per_month(
+            df[np.isin(month_codes(df["datetime"]), redo)], eps_meters=eps_meters, min_samples=min_samples,
+            n_jobs=n_jobs, cell_meters=cell_meters, metric=metric, **eval_kwargs
+        )
+        parts.append(fresh)
+
+    merged = pd.concat(parts, ignore_index=True)
+    merged = merged.sort_values("datetime", kind="stable").reset_index(drop=True)
+    return merged, changed, avg_DBCV_score, new_manifest
+
+
+def build_manifest(df, eps_meters=50, min_samples=5, cell_meters=None, metric="haversine"):
+    """Manifest describing a cleaned frame that has just been clustered with these parameters."""
+    return {
+        "params": {"eps_meters": eps_meters, "min_samples": min_samples,
+                   "cell_meters": cell_meters, "metric": metric},
+        "months": month_hashes(df),
+    }
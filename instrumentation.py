@@ -0,0 +1,230 @@
+# instrumentation.py
+import os
+import csv
+import json
+import time
+import cProfile
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+
+try:
+    import psutil
+except ImportError:  # optional: peak working set on Windows
+    psutil = None
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+RUN_LOG_DIR = "run_logs"
+# open RunLog spans of this process, innermost last (see measure_call)
+_OPEN_SPANS = []
+RECORD_FIELDS = [
+    "user", "stage", "action", "month", "wall_s", "cpu_s",
+    "peak_rss_mib", "tracemalloc_peak_mib", "points_in", "points_out", "extra",
+]
+
+
+# ------------ PEAK MEMORY ------------
+def reset_peak_rss():
+    """Restart the peak-RSS counter where the OS allows it (Linux); True if it did."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss_bytes():
+    """
+    Peak resident set size of this process: since the last reset_peak_rss
+    on Linux, over the whole process lifetime elsewhere. None if unknown.
+    """
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    if psutil is not None:
+        peak = getattr(psutil.Process().memory_info(), "peak_wset", None)
+        if peak is not None:
+            return peak
+    if resource is not None:
+        # kilobytes on Linux, bytes on macOS
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    return None
+
+
+def _mib(n):
+    return None if n is None else round(n / 2**20, 1)
+
+
+def _save_open_peak():
+    """Fold the peaks so far into the innermost open RunLog span before a reset."""
+    if _OPEN_SPANS:
+        span = _OPEN_SPANS[-1]
+        span["rss"] = max(span["rss"], peak_rss_bytes() or 0)
+        if tracemalloc.is_tracing():
+            span["traced"] = max(span["traced"], tracemalloc.get_traced_memory()[1])
+
+
+def measure_call(fn, *args, **kwargs):
+    """
+    Run fn and return (result, stats) with its wall/CPU seconds, peak RSS and,
+    while tracemalloc is tracing, its tracemalloc peak. Both peaks are reset
+    first so they cover this call only (the RSS one where the OS allows it);
+    an enclosing RunLog span's peak so far is saved before the reset, as for
+    nested spans. Picklable, so it can wrap work sent to a process pool.
+    """
+    tracing = tracemalloc.is_tracing()
+    _save_open_peak()
+    reset_peak_rss()
+    if tracing:
+        tracemalloc.reset_peak()
+    wall, cpu = time.perf_counter(), time.process_time()
+    result = fn(*args, **kwargs)
+    stats = {
+        "wall_s": round(time.perf_counter() - wall, 4),
+        "cpu_s": round(time.process_time() - cpu, 4),
+        "peak_rss_mib": _mib(peak_rss_bytes()),
+        "tracemalloc_peak_mib": _mib(tracemalloc.get_traced_memory()[1]) if tracing else None,
+    }
+    return result, stats
+
+
+def worker_initializer():
+    """Process pool initializer so workers trace memory when this process does (else None)."""
+    return tracemalloc.start if tracemalloc.is_tracing() else None
+
+
+def count_points(value):
+    """Rows in a stage value: a frame's length or a point store index's total."""
+    if hasattr(value, "shape") and hasattr(value, "columns"):
+        return len(value)
+    if isinstance(value, dict) and isinstance(value.get("months"), dict):
+        return sum(value["months"].values())
+    return None
+
+
+# ------------ RUN LOG ------------
+class RunLog:
+    """
+    Per-stage (and per-month) timing and memory records for one process.
+
+    measure() spans may nest (a month inside a stage); a span's peaks cover
+    everything run inside it. tracemalloc adds overhead and is only on with
+    trace_memory=True. With profile=True every top-level span runs under
+    cProfile and the slowest one's profile is kept for dump_profile().
+    """
+
+    def __init__(self, trace_memory=False, profile=False):
+        self.records = []
+        self.trace_memory = trace_memory
+        self.profile = profile
+        self._stack = []
+        self._slowest = None  # (wall seconds, record, profiler)
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    @contextmanager
+    def measure(self, user, stage, action="run", month=None, points_in=None):
+        """
+        Time the body and append its record; the body may fill in
+        record["points_out"] (or "points_in"/"extra") on the yielded dict.
+        """
+        record = {"user": user, "stage": stage, "action": action, "month": month,
+                  "points_in": points_in, "points_out": None, "extra": None}
+        # counters are reset per span, so the enclosing span's peak so far is
+        # saved first and child spans report their peaks up when they end
+        _save_open_peak()
+        span = {"rss": 0, "traced": 0}
+        self._stack.append(span)
+        _OPEN_SPANS.append(span)
+        reset_peak_rss()
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+        profiler = None
+        if self.profile and len(self._stack) == 1:
+            profiler = cProfile.Profile()
+            profiler.enable()
+
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield record
+        finally:
+            record["wall_s"] = round(time.perf_counter() - wall, 4)
+            record["cpu_s"] = round(time.process_time() - cpu, 4)
+            if profiler is not None:
+                profiler.disable()
+            self._stack.pop()
+            _OPEN_SPANS.pop()
+
+            rss = max(peak_rss_bytes() or 0, span["rss"]) or None
+            traced = None
+            if self.trace_memory:
+                traced = max(tracemalloc.get_traced_memory()[1], span["traced"])
+            if self._stack:
+                parent = self._stack[-1]
+                parent["rss"] = max(parent["rss"], rss or 0)
+                parent["traced"] = max(parent["traced"], traced or 0)
+            record["peak_rss_mib"] = _mib(rss)
+            record["tracemalloc_peak_mib"] = _mib(traced)
+            self.records.append(record)
+
+            if profiler is not None and (self._slowest is None or record["wall_s"] > self._slowest[0]):
+                self._slowest = (record["wall_s"], record, profiler)
+
+    def add(self, user, stage, action="run", month=None, **stats):
+        """Append a record measured elsewhere, e.g. by measure_call in a worker."""
+        record = dict.fromkeys(RECORD_FIELDS)
+        record.update(user=user, stage=stage, action=action, month=month, **stats)
+        self.records.append(record)
+        return record
+
+    def dump_profile(self, log_dir=RUN_LOG_DIR):
+        """
+        Write the slowest profiled span as <user>_<stage>_<time>.prof (pstats
+        format, e.g. for snakeviz); returns its path.
+        """
+        if self._slowest is None:
+            return None
+        _, record, profiler = self._slowest
+        os.makedirs(log_dir, exist_ok=True)
+        stamp = time.strftime("%Y%m%d-%H%M%S")
+        path = os.path.join(log_dir, f"{record['user']}_{record['stage']}_{stamp}.prof")
+        profiler.dump_stats(path)
+        return path
+
+
+def span(run_log, user, stage, action="run", month=None, points_in=None):
+    """run_log.measure(...), or a no-op yielding a throwaway record when run_log is None."""
+    if run_log is None:
+        return nullcontext({})
+    return run_log.measure(user, stage, action, month, points_in)
+
+
+def write_run_log(records, log_dir=RUN_LOG_DIR, run_id=None, meta=None):
+    """
+    Write records as <run_id>.csv (one row per record) and <run_id>.json
+    (meta plus the same records). Returns the two paths.
+    """
+    run_id = run_id or time.strftime("%Y%m%d-%H%M%S")
+    os.makedirs(log_dir, exist_ok=True)
+    csv_path = os.path.join(log_dir, f"{run_id}.csv")
+    json_path = os.path.join(log_dir, f"{run_id}.json")
+
+    with open(csv_path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=RECORD_FIELDS)
+        writer.writeheader()
+        for record in records:
+            row = {k: record.get(k) for k in RECORD_FIELDS}
+            if row["extra"] is not None:
+                row["extra"] = json.dumps(row["extra"], sort_keys=True)
+            writer.writerow(row)
+    with open(json_path, "w", encoding="utf-8") as f:
+        json.dump({"run_id": run_id, "meta": meta or {}, "records": records}, f, indent=1, default=str)
+    return csv_path, json_path
@@ -1,28 +1,52 @@
 # main.py
 import os
+import glob
+import json
+import time
 import pandas as pd
-from data_load import load_all_csvs, clean_gps
-from clustering import cluster_locations_per_month, compute_time_spent
-from analysis import top_locations_monthly, movement_transitions, weekday_weekend_stats
-from mapping import make_maps_for_user
-from plots import plot_user_report
+from data_load import DATA_PATH, CACHE_DIR, read_gps_csv, compact_points
+from clustering import cluster_locations_per_month
+from incremental import incremental_cluster, build_manifest, save_manifest, remove_manifest
+from analysis import (
+    build_dwell_facts, cluster_centroids, point_dwell_hours,
+    top_locations_monthly, movement_transitions, weekday_weekend_stats, top_cluster_mask,
+    segment_visits, point_counts, cluster_extents, place_hours,
+)
+from places import link_places, attach_places
+from mapping import make_maps_for_user, make_lazy_maps_for_user, write_lazy_page, list_month_data, remove_month_data
+from plots import plot_if_changed, PLOT_DIR, PLOT_VERSION
+from pipeline import STAGE_GRAPH, run_user, print_plan
+from scheduler import run_users
+from instrumentation import RUN_LOG_DIR, RunLog, span, write_run_log
+from point_store import BackgroundWriter, index_path, load_index, iter_points, read_points, write_points
+from partitioned import partition_gps_csv, cluster_partitions, summarize_partitions
+from place_index import PLACE_INDEX_DIR, build_place_indexes, index_manifest_path, iter_month_frames
 
 CLUSTERED_DIR = "clustered_outputs"
 EVALUATION_DIR = "cluster_evaluation"
 REPORT_DIR = "reports"
+MAP_DIR = "maps"
+# columns of the stored clustered points that later stages read
+CLUSTERED_COLUMNS = ["datetime", "latitude", "longitude", "month", "cluster"]
+
+# === CLEANING / CLUSTERING SETTINGS ===
+MAX_ACCURACY = 50
+# jump outliers and redundant stationary fixes (see data_load.filter_trajectory); None turns a filter off
+TRAJECTORY_FILTER = dict(max_speed_kmh=300, dedup_meters=5)
+# grid pre-aggregation (cell_meters) caps each cell's weight at min_samples and is
+# not yet checked against raw HDBSCAN labels, so it stays opt-in
+CLUSTER_PARAMS = dict(eps_meters=50, min_samples=5, cell_meters=None)
+# linking monthly clusters into places that persist across months (see places.py)
+PLACE_LINK_PARAMS = dict(link_meters=CLUSTER_PARAMS["eps_meters"], max_radius_m=250)
+# nearest-cluster lookup for new fixes (see place_index.py)
+PLACE_INDEX_PARAMS = dict(max_distance_m=CLUSTER_PARAMS["eps_meters"], cell_meters=10, max_per_cluster=500)
 
 # === MAP GENERATION SETTINGS ===
 GENERATE_SPECIFIC_CLUSTERS = True
 SPECIFIC_CLUSTER_MODE = "overall_top"
 MANUAL_CLUSTERS = [33, 17, 36]  # only used if SPECIFIC_CLUSTER_MODE == "manual"
-
-def main(run_clustering: bool = True, run_mapping: bool = False):
-
-    #Reset metrics file
-    path = os.path.join(EVALUATION_DIR, "evaluation_metrics.txt")
-    if path:
-        f = open(path, 'w')
-        f.close()
+MAP_RENDER = "bins"  # "bins" (grid cells + centroids), "canvas" or "markers" (sampled points)
+MAP_LAYOUT = "lazy"  # "lazy" (shell page + one data file per month) or "tabs" (single HTML)
 
 # ------------ WRITE REPORT FILES ------------
 def save_user_report(username, top5_monthly, week_stats, weekend_stats, transitions, summary_info):
@@ -39,7 +63,8 @@ def save_user_report(username, top5_monthly, week_stats, weekend_stats, transiti
         f.write(f"Non-noise points: {summary_info['non_noise']}\n")
         f.write(f"Noise points: {summary_info['noise']}\n")
         f.write(f"Detected clusters: {summary_info['n_clusters']}\n")
-        f.write(f"Top overall clusters: {summary_info['top_overall']}\n\n")
+        f.write(f"Linked places: {summary_info['n_places']}\n")
+        f.write(f"Top overall places: {summary_info['top_overall']}\n\n")
 
         # === Top 5 Locations Per Month (condensed) ===
         f.write("=== Top 5 Locations Per Month ===\n")
@@ -50,16 +75,16 @@ def save_user_report(username, top5_monthly, week_stats, weekend_stats, transiti
             f.write(f"{month}: {top_str}\n")
 
         # === Weekday vs Weekend ===
-        f.write("\n=== Weekday vs Weekend Time Spent ===\n")
+        f.write("\n=== Weekday vs Weekend Time Spent (places) ===\n")
         if not week_stats.empty:
-            week_str = ", ".join([f"{row['cluster']}({row['hours']:.1f}h)" 
+            week_str = ", ".join([f"{row['place']}({row['hours']:.1f}h)" 
                                   for _, row in week_stats.iterrows()])
             f.write(f"Weekdays: {week_str}\n")
         else:
             f.write("Weekdays: No data\n")
 
         if not weekend_stats.empty:
-            weekend_str = ", ".join([f"{row['cluster']}({row['hours']:.1f}h)" 
+            weekend_str = ", ".join([f"{row['place']}({row['hours']:.1f}h)" 
                                      for _, row in weekend_stats.iterrows()])
             f.write(f"Weekends: {weekend_str}\n")
         else:
@@ -79,163 +104,554 @@ def save_user_report(username, top5_monthly, week_stats, weekend_stats, transiti
 
 
 
-# ------------ MAIN PROGRAM ------------
-def main(run_clustering: bool = True):
-    print("\n=== Loading CSV Files ===\n")
-    datasets = load_all_csvs()
-
-    print("\n=== Cleaning Data ===\n")
-    cleaned = {}
-    for name, df in datasets.items():
-        clean_df = clean_gps(df)
-        clean_df["datetime"] = pd.to_datetime(clean_df["datetime"])
-        cleaned[name] = clean_df
-        print(f"{name}: {clean_df.shape[0]} rows remain after cleaning")
+# ------------ STRUCTURED REPORTS ------------
+def _cluster_rows(df, key="cluster"):
+    return [{key: int(getattr(row, key)), "hours": float(row.hours)} for row in df.itertuples()]
+
+
+def build_user_report(username, top5_monthly, week_stats, weekend_stats, transitions, summary_info):
+    """
+    The same content as save_user_report as a plain dict, at full precision.
+    This is what plots.plot_user_data consumes. Monthly tops list
+    month-local cluster IDs; top_overall, weekday, weekend and transitions
+    list place IDs (see places.py).
+    """
+    return {
+        "user": username,
+        "summary": {
+            "total_points": int(summary_info["total_points"]),
+            "non_noise": int(summary_info["non_noise"]),
+            "noise": int(summary_info["noise"]),
+            "n_clusters": int(summary_info["n_clusters"]),
+            "n_places": int(summary_info["n_places"]),
+            "top_overall": [int(p) for p in summary_info["top_overall"]],
+        },
+        "monthly_top": {str(month): _cluster_rows(df) for month, df in top5_monthly.items()},
+        "weekday": _cluster_rows(week_stats, "place"),
+        "weekend": _cluster_rows(weekend_stats, "place"),
+        "transitions": [
+            {"place": int(row.place), "next_place": int(row.next_place), "count": int(row.count)}
+            for row in transitions.itertuples()
+        ],
+    }
+
+
+def save_user_report_json(report):
+    os.makedirs(REPORT_DIR, exist_ok=True)
+    path = os.path.join(REPORT_DIR, f"{report['user']}_report.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=1)
+    print(f"Saved structured report > {path}")
+    return path
+
+
+def report_frames(report):
+    """Turn a report dict back into the arguments save_user_report takes."""
+    def hours_frame(rows, key="cluster"):
+        return pd.DataFrame(rows, columns=[key, "hours"])
+
+    top5_monthly = {month: hours_frame(rows) for month, rows in report["monthly_top"].items()}
+    transitions = pd.DataFrame(report["transitions"], columns=["place", "next_place", "count"])
+    return dict(
+        username=report["user"],
+        top5_monthly=top5_monthly,
+        week_stats=hours_frame(report["weekday"], "place"),
+        weekend_stats=hours_frame(report["weekend"], "place"),
+        transitions=transitions,
+        summary_info=report["summary"],
+    )
+
+
+# ------------ PIPELINE STAGES ------------
+# Every stage works on one user. "run" builds and writes the stage's artifact,
+# "load" reads it back when only a later stage is stale, and "outputs" lists
+# the files that must exist for the stage to count as built.
+
+def _clean_path(user):
+    return os.path.join(CACHE_DIR, f"{user}.parquet")
+
+
+def _clustered_path(user):
+    return index_path(user, CLUSTERED_DIR)
+
+
+def _facts_path(user):
+    return os.path.join(CLUSTERED_DIR, f"{user}_dwell_facts.parquet")
+
+
+def _places_path(user):
+    return os.path.join(CLUSTERED_DIR, f"{user}_places.parquet")
+
+
+def _report_json_path(user):
+    return os.path.join(REPORT_DIR, f"{user}_report.json")
+
+
+def _log_filter(run_log, name, dropped, rows_out):
+    """Rows removed by each trajectory filter, as one run-log record."""
+    if run_log is not None:
+        run_log.add(name, "trajectory_filter", "drop", points_in=rows_out + sum(dropped.values()),
+                    points_out=rows_out, extra=dropped)
 
+
+def run_clean(ctx):
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    dropped = {}
+    df = read_gps_csv(ctx["load"], max_accuracy=MAX_ACCURACY, stats=dropped, **TRAJECTORY_FILTER)
+    df.to_parquet(_clean_path(ctx["user"]), index=False)
+    _log_filter(ctx["run_log"], ctx["user"], dropped, len(df))
+    print(f"{ctx['user']}: {df.shape[0]} rows remain after cleaning")
+    return df
+
+
+def _evaluation_path(user):
+    return os.path.join(EVALUATION_DIR, f"{user}_evaluation.json")
+
+
+def save_evaluation(name, month_stats, months):
+    """
+    Rewrite the user's DBCV record, cluster_evaluation/<user>_evaluation.json:
+    the score of every current month and their average. Months that were not
+    reclustered this run keep their stored score. Returns the average.
+    """
+    os.makedirs(EVALUATION_DIR, exist_ok=True)
+    scores = {}
+    if os.path.exists(_evaluation_path(name)):
+        with open(_evaluation_path(name), "r", encoding="utf-8") as f:
+            scores = json.load(f)["months"]
+    scores.update({m["month"]: m["dbcv"] for m in month_stats})
+    scores = {m: scores.get(m) for m in sorted(months)}
+
+    valid = [s for s in scores.values() if s is not None]
+    avg_DBCV_score = sum(valid) / len(valid) if valid else None
+    with open(_evaluation_path(name), "w", encoding="utf-8") as f:
+        json.dump({"user": name, "avg_dbcv": avg_DBCV_score, "months": scores}, f, indent=1)
+    print(f"{name} had an average DBCV score of: {avg_DBCV_score}")
+    return avg_DBCV_score
+
+
+def _log_months(run_log, name, month_stats):
+    """Per-month HDBSCAN fit and DBCV records from cluster_locations_per_month."""
+    if run_log is None:
+        return
+    for m in month_stats:
+        run_log.add(name, "hdbscan_fit", "month", m["month"], points_in=m["points_in"],
+                    points_out=m["points_out"], extra={"points_clustered": m["points_clustered"]},
+                    **m["fit"])
+        if m["dbcv_time"] is not None:
+            run_log.add(name, "dbcv", "month", m["month"], extra={"score": m["dbcv"]}, **m["dbcv_time"])
+
+
+def run_cluster(ctx, writer, incremental=False, n_jobs=-1):
+    name, df = ctx["user"], ctx["clean"]
     os.makedirs(CLUSTERED_DIR, exist_ok=True)
-    clustered = {}
-
-    # Run clustering
-    if run_clustering:
-        print("\n=== Clustering Locations Per Month ===\n")
-        for name, df in cleaned.items():
-            cluster_df, avg_DBCV_score = cluster_locations_per_month(
-                df, eps_meters=50, min_samples=5, n_jobs=-1
-            )
-            clustered[name] = cluster_df
-
-            # save clustered csv
-            out_path = os.path.join(CLUSTERED_DIR, f"{name}_clustered.csv")
-            cluster_df.to_csv(out_path, index=False)
-
-            #Save the evalutation metrics
-            out_path2 = os.path.join(EVALUATION_DIR, "evaluation_metrics.txt")
-            if not os.path.exists(out_path):
-                with open(out_path2, 'w') as f:
-                    f.write(f"{name} had an average DBCV score of: {avg_DBCV_score}\n")
-            else:
-                with open(out_path2, 'a') as f:
-                    f.write(f"{name} had an average DBCV score of: {avg_DBCV_score}\n")
-            f.close()
-                
-
-            # >>> NEW: detailed clustering stats <<<
-            total_points = len(cluster_df)
-            noise_points = (cluster_df["cluster"] == -1).sum()
-            non_noise = total_points - noise_points
-            n_clusters = cluster_df["cluster"].nunique() - (1 if -1 in cluster_df["cluster"].unique() else 0)
-
-            print(
-                f"{name}: {n_clusters} clusters, "
-                f"{non_noise}/{total_points} non-noise points (saved to {out_path})"
-            )
+    out_path = _clustered_path(name)
+    month_stats = []
+
+    changed = None
+    if incremental and os.path.exists(out_path):
+        # only months whose cleaned rows changed since the last run are reclustered,
+        # and only the unchanged months are read back from the store
+        stored = lambda months: read_points(name, CLUSTERED_DIR, months=months)
+        cluster_df, changed, _, manifest = incremental_cluster(
+            name, df, stored, CLUSTERED_DIR, n_jobs=n_jobs, month_stats=month_stats, **CLUSTER_PARAMS
+        )
+        ctx["changed_months"] = changed
     else:
-        print("\n=== Loading PRE-COMPUTED Clustered Data ===\n")
-        for name in cleaned.keys():
-            path = os.path.join(CLUSTERED_DIR, f"{name}_clustered.csv")
-            if not os.path.exists(path):
-                raise FileNotFoundError(f"Clustered file missing: {path}")
-            df = pd.read_csv(path, parse_dates=["datetime"])
-            clustered[name] = df
-            print(f"{name}: loaded {df.shape[0]} rows from {path}")
-
-    # -------------------------------------------------
-    # WRITE REPORTS INSTEAD OF PRINTING EVERYTHING
-    # -------------------------------------------------
-    print("\n=== Generating Reports ===\n")
-
-    for name, df in clustered.items():
-
-        # Top 5 monthly
-        top5_monthly = top_locations_monthly(df, n=5)
-
-        # Weekday vs Weekend
-        week, weekend = weekday_weekend_stats(df)
-        week = week[week['cluster'] != -1].head(5)
-        weekend = weekend[weekend['cluster'] != -1].head(5)
-
-        # Transitions
-        transitions = movement_transitions(df)
-
-        # Summary info
-        cluster_hours = compute_time_spent(df)
-        cluster_hours = cluster_hours[cluster_hours['cluster'] != -1]
-        top_overall = cluster_hours.head(5)['cluster'].tolist()
-
-        summary_info = {
-            "total_points": len(df),
-            "non_noise": (df["cluster"] != -1).sum(),
-            "noise": (df["cluster"] == -1).sum(),
-            "n_clusters": df["cluster"].nunique() - (1 if -1 in df["cluster"].unique() else 0),
-            "top_overall": top_overall
-        }
+        cluster_df, _ = cluster_locations_per_month(df, n_jobs=n_jobs, month_stats=month_stats,
+                                                    **CLUSTER_PARAMS)
+        manifest = build_manifest(df, **CLUSTER_PARAMS)
 
-        # Save report file
-        save_user_report(
-            username=name,
-            top5_monthly=top5_monthly,
-            week_stats=week,
-            weekend_stats=weekend,
-            transitions=transitions,
-            summary_info=summary_info
-        )
+    # the month partitions, then the manifest that describes them, are written
+    # on the background thread while the later stages run
+    writer.submit(write_points, name, cluster_df, CLUSTERED_DIR, months=changed)
+    writer.submit(save_manifest, name, manifest, CLUSTERED_DIR)
+
+    save_evaluation(name, month_stats, manifest["months"])
+    _log_months(ctx["run_log"], name, month_stats)
+
+    # >>> NEW: detailed clustering stats <<<
+    total_points = len(cluster_df)
+    noise_points = (cluster_df["cluster"] == -1).sum()
+    non_noise = total_points - noise_points
+    n_clusters = cluster_df["cluster"].nunique() - (1 if -1 in cluster_df["cluster"].unique() else 0)
+
+    print(
+        f"{name}: {n_clusters} clusters, "
+        f"{non_noise}/{total_points} non-noise points (writing to {out_path})"
+    )
+    return cluster_df
+
+
+def load_cluster(ctx):
+    df = read_points(ctx["user"], CLUSTERED_DIR, columns=CLUSTERED_COLUMNS)
+    print(f"{ctx['user']}: loaded {df.shape[0]} rows from {_clustered_path(ctx['user'])}")
+    return df
+
+
+def run_index(ctx):
+    # built from the frame in memory: the store may still be being written
+    built = build_place_indexes(ctx["user"], iter_month_frames(ctx["cluster"]), PLACE_INDEX_DIR,
+                                **PLACE_INDEX_PARAMS)
+    print(f"{ctx['user']}: place index of {sum(built.values())} exemplars over {len(built)} months")
+
+
+def run_analyze(ctx):
+    df = ctx["cluster"]
+    # one pass over the points; every dwell statistic comes from this table
+    return _save_analysis(ctx["user"], build_dwell_facts(df), segment_visits(df), point_counts(df),
+                          cluster_extents(df))
+
+
+def _save_analysis(name, facts, visits, counts, extents):
+    # cluster IDs restart every month; places link them across months
+    places = link_places(extents, **PLACE_LINK_PARAMS)
+    facts = attach_places(facts, places)
+
+    # Top 5 monthly
+    top5_monthly = top_locations_monthly(facts=facts, n=5)
+
+    # Weekday vs Weekend
+    week, weekend = weekday_weekend_stats(facts=facts)
+    week = week.head(5)
+    weekend = weekend.head(5)
+
+    # Transitions between places, so pairs from different months line up
+    transitions = movement_transitions(visits=attach_places(visits, places))
+
+    # Summary info
+    top_overall = place_hours(facts).head(5)['place'].tolist()
+
+    summary_info = {
+        "total_points": counts["total_points"],
+        "non_noise": counts["total_points"] - counts["noise"],
+        "noise": counts["noise"],
+        "n_clusters": len(counts["clusters"]),
+        "n_places": int(places["place"].nunique()),
+        "top_overall": top_overall
+    }
+
+    # Machine-readable report; the text report and the plots are drawn from it
+    report = build_user_report(name, top5_monthly, week, weekend, transitions, summary_info)
+    save_user_report_json(report)
+    facts.to_parquet(_facts_path(name), index=False)
+    places.to_parquet(_places_path(name), index=False)
+    return {"report": report, "facts": facts, "places": places}
+
+
+def load_analyze(ctx):
+    with open(_report_json_path(ctx["user"]), "r", encoding="utf-8") as f:
+        report = json.load(f)
+    return {"report": report, "facts": pd.read_parquet(_facts_path(ctx["user"])),
+            "places": pd.read_parquet(_places_path(ctx["user"]))}
+
+
+def run_report(ctx):
+    save_user_report(**report_frames(ctx["analyze"]["report"]))
+
+
+def run_plot(ctx):
+    # the upstream keys change with the CSV's mtime; an identical report keeps its PNG
+    plot_if_changed(ctx["analyze"]["report"], PLOT_DIR, force=ctx["plan"]["plot"] == "forced")
+
+
+def _map_selection(facts):
+    """
+    {month: [cluster, ...]} to map: each month's top clusters, narrowed to
+    the top overall places or the manual cluster IDs when mapping specific
+    clusters. Also returns what was selected, for messages (None if all).
+    """
+    t5 = top_locations_monthly(facts=facts, n=5)
+    top5_clusters = {month: v["cluster"].tolist() for month, v in t5.items()}
+    if not GENERATE_SPECIFIC_CLUSTERS:
+        return top5_clusters, None
 
-    # ---- Plot generation ---
-    plot_user_report()   
-
-    # ---- Map generation ----
-    print("\n=== Generating Maps ===\n")
-
-    top5_clusters = {}
-    for name, df in clustered.items():
-        t5 = top_locations_monthly(df, n=5)
-        top5_clusters[name] = {month: v["cluster"].tolist() for month, v in t5.items()}
-
-    top5_dated = {}
-    top_overall_clusters = {}
-
-    for name, df in clustered.items():
-        newdf = df.copy()
-        newdf["month"] = newdf["datetime"].dt.to_period("M")
-        newdf = newdf[newdf["cluster"] != -1]
-        valid_months = [pd.Period(m) for m in top5_clusters[name].keys()]
-        newdf = newdf[newdf["month"].isin(valid_months)]
-
-        def get_top5(group):
-            month_str = str(group.name)
-            top_clusters = top5_clusters[name].get(month_str, [])
-            return group[group["cluster"].isin(top_clusters)]
-
-        newdf = newdf.groupby("month", group_keys=False).apply(get_top5)
-        top5_dated[name] = newdf
-
-        all_top = []
-        for month_clusters in top5_clusters[name].values():
-            all_top.extend(month_clusters)
-        all_unique = list(dict.fromkeys(all_top))
-        top_overall_clusters[name] = all_unique[:5]
-
-    def make_maps_for_specific_clusters(user: str, df: pd.DataFrame, clusters: list[int]):
-        df_filtered = df[df["cluster"].isin(clusters)]
-        if df_filtered.empty:
-            print(f"No points found for clusters {clusters} in {user}.")
+    if SPECIFIC_CLUSTER_MODE == "overall_top":
+        # the same places as the report's top_overall, whatever their cluster ID in each month
+        places = place_hours(facts).head(5)["place"].tolist()
+        wanted = facts[facts["place"].isin(places)]
+        keep = set(zip(wanted["month"].tolist(), wanted["cluster"].tolist()))
+        selected = f"places {places}"
+    else:
+        keep = {(month, c) for month in top5_clusters for c in MANUAL_CLUSTERS}
+        selected = f"clusters {MANUAL_CLUSTERS}"
+    selection = {month: [c for c in clusters if (month, c) in keep] for month, clusters in top5_clusters.items()}
+    return {month: clusters for month, clusters in selection.items() if clusters}, selected
+
+
+def _map_points(df, selection):
+    # dwell is measured on the full sequence before any filtering; only the
+    # selected points are copied
+    mask = top_cluster_mask(df, selection)
+    return df[mask].assign(dwell_hours=point_dwell_hours(df)[mask])
+
+
+def _map_selection_path(user):
+    return os.path.join(MAP_DIR, f"{user}_map_selection.json")
+
+
+def _save_map_selection(user, selection):
+    """Record which clusters each month's map data shows, for later partial rewrites."""
+    os.makedirs(MAP_DIR, exist_ok=True)
+    with open(_map_selection_path(user), "w", encoding="utf-8") as f:
+        json.dump({month: [int(c) for c in clusters] for month, clusters in selection.items()},
+                  f, indent=1, sort_keys=True)
+
+
+def _partial_map_months(user, selection, changed):
+    """
+    `changed` if only those months' map data needs rewriting, else None: the
+    selection (e.g. the top overall places) spans every month, so a partial
+    rewrite is only safe when every other month selects what its stored
+    data file shows.
+    """
+    if changed is None or not os.path.exists(_map_selection_path(user)):
+        return None
+    with open(_map_selection_path(user), "r", encoding="utf-8") as f:
+        stored = json.load(f)
+    current = {month: [int(c) for c in clusters] for month, clusters in selection.items()}
+    for month in (set(stored) | set(current)) - set(changed):
+        if stored.get(month) != current.get(month):
+            return None
+    return changed
+
+
+def run_map(ctx):
+    name, df, facts = ctx["user"], ctx["cluster"], ctx["analyze"]["facts"]
+
+    selection, selected = _map_selection(facts)
+    centroids = cluster_centroids(df)
+    newdf = _map_points(df, selection)
+    if selected is not None and newdf.empty:
+        print(f"No points found for {selected} in {name}.")
+        return
+
+    if MAP_LAYOUT == "lazy":
+        # after an incremental recluster only the changed months' data files are
+        # rewritten, provided no other month's selection moved with them
+        months = None
+        if ctx["plan"]["map"] == "upstream changed":
+            months = _partial_map_months(name, selection, ctx.get("changed_months"))
+        if months == []:
+            print(f"{name}: no months changed, map data kept")
             return
-        make_maps_for_user(user, df_filtered)
-        print(f"Map generated for {user}, clusters {clusters}.")
-
-    # Map loop
-    for name, df in top5_dated.items():
-        if GENERATE_SPECIFIC_CLUSTERS:
-            if SPECIFIC_CLUSTER_MODE == "overall_top":
-                clusters_to_map = top_overall_clusters[name]
-            else:
-                clusters_to_map = MANUAL_CLUSTERS
-            make_maps_for_specific_clusters(name, df, clusters_to_map)
-        else:
-            make_maps_for_user(name, df)
+        make_lazy_maps_for_user(name, newdf, centroids=centroids, render=MAP_RENDER,
+                                output_dir=MAP_DIR, months=months)
+        _save_map_selection(name, selection)
+    else:
+        make_maps_for_user(name, newdf, centroids=centroids, render=MAP_RENDER, output_dir=MAP_DIR)
+    print(f"Map generated for {name}.")
+
+
+def _map_outputs(user):
+    if MAP_LAYOUT == "lazy":
+        return [os.path.join(MAP_DIR, f"{user}_viewer.html")]
+    return [os.path.join(MAP_DIR, f"{user}_monthly_tabs.html")]
+
+
+# ------------ OUT-OF-CORE STAGES ------------
+# Same artifacts for analyze/report/plot/map, but the cleaned and clustered
+# points live only in month-partitioned stores (see partitioned.py); ctx holds
+# the store index instead of a frame and at most a few months are in memory.
+
+def run_clean_partitioned(ctx):
+    dropped = {}
+    index = partition_gps_csv(ctx["load"], ctx["user"], CACHE_DIR, max_accuracy=MAX_ACCURACY, stats=dropped,
+                              **TRAJECTORY_FILTER)
+    _log_filter(ctx["run_log"], ctx["user"], dropped, sum(index["months"].values()))
+    print(f"{ctx['user']}: {sum(index['months'].values())} rows remain after cleaning")
+    return index
+
+
+def run_cluster_partitioned(ctx, n_jobs=-1):
+    name = ctx["user"]
+    month_stats = []
+    # the store is rewritten without a manifest, so incremental runs must not trust the old one
+    remove_manifest(name, CLUSTERED_DIR)
+    cluster_partitions(name, CACHE_DIR, CLUSTERED_DIR, n_jobs=n_jobs, month_stats=month_stats,
+                       **CLUSTER_PARAMS)
+    save_evaluation(name, month_stats, load_index(name, CACHE_DIR)["months"])
+    _log_months(ctx["run_log"], name, month_stats)
+    print(f"{name}: clustered month partitions written to {_clustered_path(name)}")
+    return load_index(name, CLUSTERED_DIR)
+
+
+def run_index_partitioned(ctx):
+    months = iter_points(ctx["user"], CLUSTERED_DIR, ["latitude", "longitude", "cluster"])
+    built = build_place_indexes(ctx["user"], months, PLACE_INDEX_DIR, **PLACE_INDEX_PARAMS)
+    print(f"{ctx['user']}: place index of {sum(built.values())} exemplars over {len(built)} months")
+
+
+def run_analyze_partitioned(ctx):
+    parts = summarize_partitions(ctx["user"], CLUSTERED_DIR, CLUSTERED_COLUMNS, run_log=ctx["run_log"])
+    return _save_analysis(ctx["user"], parts["facts"], parts["visits"], parts["counts"], parts["extents"])
+
+
+def run_map_partitioned(ctx):
+    # months are read, selected and written one at a time; the point sampling
+    # limits of the point renderers therefore apply per month only
+    name, facts = ctx["user"], ctx["analyze"]["facts"]
+    if MAP_LAYOUT != "lazy":
+        print(f"{name}: out-of-core maps use the lazy layout")
+
+    selection, selected = _map_selection(facts)
+    written = set()
+    for month, part in iter_points(name, CLUSTERED_DIR, CLUSTERED_COLUMNS, months=sorted(selection)):
+        points = _map_points(part, selection)
+        if points.empty:
+            continue
+        make_lazy_maps_for_user(name, points, centroids=cluster_centroids(part), render=MAP_RENDER,
+                                output_dir=MAP_DIR, months=[month])
+        written.add(month)
+
+    # a full rewrite: months written by an earlier run but not this one are stale
+    removed = remove_month_data(name, set(list_month_data(name, MAP_DIR)) - written, MAP_DIR)
+    if not written:
+        print(f"No points found for {selected or 'the top clusters'} in {name}.")
+        if removed:
+            write_lazy_page(name, MAP_DIR)
+        return
+    write_lazy_page(name, MAP_DIR)
+    _save_map_selection(name, selection)
+    print(f"Map generated for {name}.")
+
+
+def build_stages(writer, incremental=False, n_jobs=-1, out_of_core=False):
+    if out_of_core:
+        return {
+            "load": {"run": lambda ctx: ctx["source"], "load": lambda ctx: ctx["source"]},
+            "clean": {"run": run_clean_partitioned, "load": lambda ctx: load_index(ctx["user"], CACHE_DIR),
+                      "outputs": lambda u: [index_path(u, CACHE_DIR)]},
+            "cluster": {"run": lambda ctx: run_cluster_partitioned(ctx, n_jobs),
+                        "load": lambda ctx: load_index(ctx["user"], CLUSTERED_DIR),
+                        "outputs": lambda u: [_clustered_path(u)]},
+            "index": {"run": run_index_partitioned, "load": lambda ctx: None,
+                      "outputs": lambda u: [index_manifest_path(u, PLACE_INDEX_DIR)]},
+            "analyze": {"run": run_analyze_partitioned, "load": load_analyze,
+                        "outputs": lambda u: [_report_json_path(u), _facts_path(u), _places_path(u)]},
+            "report": {"run": run_report, "load": lambda ctx: None,
+                       "outputs": lambda u: [os.path.join(REPORT_DIR, f"{u}_report.txt")]},
+            "plot": {"run": run_plot, "load": lambda ctx: None,
+                     "outputs": lambda u: [os.path.join(PLOT_DIR, f"{u}_combined_plot.png")]},
+            "map": {"run": run_map_partitioned, "load": lambda ctx: None,
+                    "outputs": lambda u: [os.path.join(MAP_DIR, f"{u}_viewer.html")]},
+        }
+    return {
+        "load": {"run": lambda ctx: ctx["source"], "load": lambda ctx: ctx["source"]},
+        "clean": {"run": run_clean, "load": lambda ctx: compact_points(pd.read_parquet(_clean_path(ctx["user"]))),
+                  "outputs": lambda u: [_clean_path(u)]},
+        "cluster": {"run": lambda ctx: run_cluster(ctx, writer, incremental, n_jobs), "load": load_cluster,
+                    "outputs": lambda u: [_clustered_path(u)]},
+        "index": {"run": run_index, "load": lambda ctx: None,
+                  "outputs": lambda u: [index_manifest_path(u, PLACE_INDEX_DIR)]},
+        "analyze": {"run": run_analyze, "load": load_analyze,
+                    "outputs": lambda u: [_report_json_path(u), _facts_path(u), _places_path(u)]},
+        "report": {"run": run_report, "load": lambda ctx: None,
+                   "outputs": lambda u: [os.path.join(REPORT_DIR, f"{u}_report.txt")]},
+        "plot": {"run": run_plot, "load": lambda ctx: None,
+                 "outputs": lambda u: [os.path.join(PLOT_DIR, f"{u}_combined_plot.png")]},
+        "map": {"run": run_map, "load": lambda ctx: None, "outputs": _map_outputs},
+    }
+
+
+def stage_params(out_of_core=False):
+    """Everything that changes a stage's output, per stage (hashed into its key)."""
+    return {
+        "clean": {"max_accuracy": MAX_ACCURACY, "filter": TRAJECTORY_FILTER, "partitioned": out_of_core},
+        "cluster": CLUSTER_PARAMS,
+        "index": PLACE_INDEX_PARAMS,
+        "analyze": {"top_n": 5, "places": PLACE_LINK_PARAMS, "transitions": "place"},
+        "plot": {"version": PLOT_VERSION},
+        "map": {
+            "render": MAP_RENDER, "layout": MAP_LAYOUT,
+            "specific": GENERATE_SPECIFIC_CLUSTERS, "mode": SPECIFIC_CLUSTER_MODE,
+            "manual": MANUAL_CLUSTERS,
+        },
+    }
+
+
+def list_sources(path=DATA_PATH):
+    """{user name: raw CSV path} for every CSV in the data folder."""
+    files = sorted(glob.glob(os.path.join(path, "*.csv")))
+    return {os.path.basename(f).replace(".csv", ""): f for f in files}
+
+
+def process_user(name, source, force=(), incremental=False, dry_run=False, n_jobs=-1,
+                 out_of_core=False, trace_memory=False, profile=False):
+    """
+    One scheduler task: bring a single user's artifacts up to date.
+    Returns {"plan", "records" (run log), "profile" (.prof path or None)}.
+    """
+    writer = BackgroundWriter()
+    stages = build_stages(writer, incremental, n_jobs, out_of_core)
+    run_log = RunLog(trace_memory=trace_memory, profile=profile)
+    try:
+        plan = run_user(name, source, stage_params(out_of_core), stages, force=force, dry_run=dry_run,
+                        run_log=run_log)
+    finally:
+        # a worker must not return before its artifacts are on disk
+        with span(run_log, name, "write", "flush"):
+            writer.flush()
+    return {"plan": plan, "records": run_log.records,
+            "profile": run_log.dump_profile(RUN_LOG_DIR) if profile else None}
+
+
+# ------------ MAIN PROGRAM ------------
+def main(dry_run: bool = False, force: tuple = (), incremental: bool = False,
+         max_workers: int = 1, memory_budget_gb: float = None, out_of_core: bool = False,
+         trace_memory: bool = False, profile: bool = False):
+    """
+    Run load -> clean -> cluster -> index/analyze -> report/plot/map for every user,
+    executing only the stages whose inputs or parameters changed since their
+    artifact was built (see pipeline.py).
+
+    - dry_run: only list what would be recomputed and why
+    - force: stage names to rerun regardless, e.g. ("cluster",)
+    - incremental: when clustering is stale, recluster only changed months
+    - max_workers: users processed at the same time (see scheduler.py)
+    - memory_budget_gb: don't start another user past this estimated total
+    - out_of_core: keep cleaned/clustered points in month-partitioned stores and
+      stream them a month at a time, for users whose history doesn't fit in memory
+    - trace_memory: add tracemalloc peaks to the run log (slower)
+    - profile: cProfile every stage and keep each user's slowest as run_logs/*.prof
+
+    Every run writes run_logs/<time>.csv/.json: wall/CPU time, peak RSS and
+    points in/out per user and stage, plus per month for HDBSCAN and DBCV.
+    """
+    unknown = set(force) - set(STAGE_GRAPH)
+    if unknown:
+        raise ValueError(f"Unknown stages: {sorted(unknown)} (stages: {list(STAGE_GRAPH)})")
+    if incremental and out_of_core:
+        raise ValueError("incremental reclustering is only available in the in-memory mode")
+
+    sources = list_sources()
+    # share the cores between users running side by side
+    n_jobs = max(1, (os.cpu_count() or 1) // max(1, max_workers))
+    budget = None if memory_budget_gb is None else int(memory_budget_gb * 2**30)
+
+    print("\n=== Dry run: stages that would be recomputed ===\n" if dry_run
+          else "\n=== Running pipeline ===\n")
+    started = time.strftime("%Y%m%d-%H%M%S")
+    results = run_users(
+        sources, process_user, max_workers=1 if dry_run else max_workers, memory_budget=budget,
+        force=force, incremental=incremental, dry_run=dry_run, n_jobs=n_jobs, out_of_core=out_of_core,
+        trace_memory=trace_memory, profile=profile,
+    )
+
+    if dry_run:
+        print_plan({name: r["plan"] for name, r in results.items()})
+        return
+
+    records = [record for name in sorted(results) for record in results[name]["records"]]
+    meta = {"max_workers": max_workers, "n_jobs": n_jobs, "incremental": incremental,
+            "out_of_core": out_of_core, "params": stage_params(out_of_core),
+            "profiles": {name: r["profile"] for name, r in results.items() if r["profile"]}}
+    csv_path, _ = write_run_log(records, RUN_LOG_DIR, run_id=started, meta=meta)
+    print(f"Run log written to {csv_path}")
 
 
 if __name__ == "__main__":
-    # first run: set to True to compute + save clusters
-    # later runs (for mapping/analysis only): change to False
-    main(run_clustering=True)
+    # only stale stages run; main(dry_run=True) lists them without running
+    # incremental=True: recluster only months with new or changed fixes
+    # out_of_core=True: stream month partitions for users too large for memory
+    main(max_workers=2, memory_budget_gb=8)
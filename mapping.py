@@ -1,8 +1,210 @@
 # mapping.py
 import os
+import json
 import folium
+import numpy as np
 import pandas as pd
+from branca.element import MacroElement
+from jinja2 import Template
 from typing import Optional
+from analysis import point_dwell_hours
+from data_load import month_codes, month_label
+
+METERS_PER_DEG_LAT = 111320.0
+
+COLORS = [
+    "red", "blue", "green", "purple", "orange",
+    "darkred", "lightred", "beige", "darkblue",
+    "darkgreen", "cadetblue", "darkpurple", "white",
+    "pink", "lightblue", "lightgreen", "gray", "black",
+]
+
+# Drawing code shared by the folium layers and the lazy viewer. Each function
+# takes a Leaflet map and a columnar payload built by point_payload/bin_payload.
+DRAW_JS = """
+function drawPoints(map, data) {
+    var renderer = L.canvas({padding: 0.5});
+    var layer = L.featureGroup().addTo(map);
+    for (var i = 0; i < data.lat.length; i++) {
+        var marker = L.circleMarker([data.lat[i], data.lon[i]], {
+            renderer: renderer, radius: 3, fill: true,
+            fillOpacity: 0.7, opacity: 0.7, color: data.colors[data.c[i]]
+        });
+        marker._idx = i;
+        layer.addLayer(marker);
+    }
+    layer.on("click", function(e) {
+        var i = e.layer._idx;
+        var t = new Date(data.t[i] * 1000).toISOString().replace("T", " ").slice(0, 19);
+        L.popup().setLatLng(e.latlng)
+            .setContent("Cluster " + data.clusters[data.c[i]] + "<br>" + t)
+            .openOn(map);
+    });
+}
+function drawBins(map, data) {
+    var renderer = L.canvas({padding: 0.5});
+    var layer = L.featureGroup().addTo(map);
+    var maxLog = Math.log(1 + Math.max.apply(null, data.n));
+    for (var i = 0; i < data.r.length; i++) {
+        var south = data.lat0 + data.r[i] * data.dlat, west = data.lon0 + data.c[i] * data.dlon;
+        var rect = L.rectangle([[south, west], [south + data.dlat, west + data.dlon]], {
+            renderer: renderer, weight: 0, color: data.colors[data.k[i]],
+            fillOpacity: 0.2 + 0.6 * Math.log(1 + data.n[i]) / maxLog
+        });
+        rect._idx = i;
+        layer.addLayer(rect);
+    }
+    layer.on("click", function(e) {
+        var i = e.layer._idx;
+        L.popup().setLatLng(e.latlng)
+            .setContent("Cluster " + data.clusters[data.k[i]] + "<br>" + data.n[i] +
+                        " points<br>" + data.h[i].toFixed(1) + " h")
+            .openOn(map);
+    });
+}
+"""
+
+
+def _to_json(payload):
+    return json.dumps(payload, separators=(",", ":"))
+
+
+def point_payload(month_df, color_map):
+    """Columnar JSON-ready dict of one month's points (rounded lat/lon, cluster code, epoch seconds)."""
+    cluster_ids = sorted(color_map)
+    codes = pd.Categorical(month_df["cluster"], categories=cluster_ids).codes
+    seconds = month_df["datetime"].to_numpy(dtype="datetime64[s]").astype(np.int64)
+    return {
+        "kind": "points",
+        "lat": np.round(month_df["latitude"].to_numpy(dtype=np.float64), 6).tolist(),
+        "lon": np.round(month_df["longitude"].to_numpy(dtype=np.float64), 6).tolist(),
+        "c": codes.tolist(),
+        "t": seconds.tolist(),
+        "clusters": [int(cid) for cid in cluster_ids],
+        "colors": [color_map[cid] for cid in cluster_ids],
+    }
+
+
+def bin_payload(month_df, color_map, bin_meters=25):
+    """Columnar JSON-ready dict of one month's grid cells (see aggregate_month_bins)."""
+    bins, grid = aggregate_month_bins(month_df, bin_meters)
+    cluster_ids = sorted(color_map)
+    codes = pd.Categorical(bins["cluster"], categories=cluster_ids).codes
+    return {
+        "kind": "bins",
+        **grid,
+        "r": bins["row"].tolist(),
+        "c": bins["col"].tolist(),
+        "k": codes.tolist(),
+        "n": bins["points"].tolist(),
+        "h": np.round(bins["hours"].to_numpy(), 2).tolist(),
+        "clusters": [int(cid) for cid in cluster_ids],
+        "colors": [color_map[cid] for cid in cluster_ids],
+    }
+
+
+class CanvasLayer(MacroElement):
+    """
+    A point or bin payload embedded once as columnar JSON and drawn on a
+    shared canvas renderer. Popups are built in the browser from the same
+    arrays when a point or cell is clicked.
+    """
+
+    _template = Template("""
+        {% macro script(this, kwargs) %}
+        (function() {
+            {{ this.draw_js }}
+            var data = {{ this.data }};
+            if (data.kind === "bins") {
+                drawBins({{ this._parent.get_name() }}, data);
+            } else {
+                drawPoints({{ this._parent.get_name() }}, data);
+            }
+        })();
+        {% endmacro %}
+    """)
+
+    def __init__(self, payload):
+        super().__init__()
+        self._name = "CanvasLayer"
+        self.draw_js = DRAW_JS
+        self.data = _to_json(payload)
+
+
+def aggregate_month_bins(month_df, bin_meters=25):
+    """
+    Bin one month's points into square grid cells of about `bin_meters`.
+
+    Returns (bins, grid): one row per (cell, cluster) with point count and
+    summed dwell hours, and the grid origin/step needed to draw the cells.
+    Uses a 'dwell_hours' column if present, else the month's own time gaps.
+    """
+    lat = month_df["latitude"].to_numpy(dtype=np.float64)
+    lon = month_df["longitude"].to_numpy(dtype=np.float64)
+    if "dwell_hours" in month_df.columns:
+        hours = month_df["dwell_hours"].to_numpy()
+    else:
+        order = np.argsort(month_df["datetime"].to_numpy(), kind="stable")
+        hours = np.empty(len(month_df))
+        hours[order] = point_dwell_hours(month_df.iloc[order])
+
+    dlat = bin_meters / METERS_PER_DEG_LAT
+    dlon = bin_meters / (METERS_PER_DEG_LAT * np.cos(np.radians(lat.mean())))
+    lat0 = float(np.floor(lat.min() / dlat) * dlat)
+    lon0 = float(np.floor(lon.min() / dlon) * dlon)
+
+    bins = (
+        pd.DataFrame({
+            "row": ((lat - lat0) // dlat).astype(np.int32),
+            "col": ((lon - lon0) // dlon).astype(np.int32),
+            "cluster": month_df["cluster"].to_numpy(),
+            "hours": hours,
+        })
+        .groupby(["row", "col", "cluster"])
+        .agg(points=("hours", "size"), hours=("hours", "sum"))
+        .reset_index()
+    )
+    grid = {"lat0": lat0, "lon0": lon0, "dlat": dlat, "dlon": dlon}
+    return bins, grid
+
+
+def _iter_months(df, centroids, render, max_points_overall, max_points_per_month, only_months=None):
+    """
+    Shared month preparation for the map writers. Yields
+    (year_month, month_df, color_map, month_centroids) for every month with
+    non-noise points; point modes are sampled down, "bins" keeps everything.
+    """
+    if not pd.api.types.is_datetime64_any_dtype(df["datetime"]):
+        df["datetime"] = pd.to_datetime(df["datetime"])
+
+    df_non_noise = df[df["cluster"] != -1]
+    if df_non_noise.empty:
+        return
+
+    # Downscale overall (bins aggregate everything instead)
+    if render != "bins" and len(df_non_noise) > max_points_overall:
+        df_non_noise = df_non_noise.sample(max_points_overall, random_state=0)
+
+    codes = month_codes(df_non_noise["datetime"])
+    for code in np.unique(codes):
+        ym = month_label(code)
+        if only_months is not None and ym not in only_months:
+            continue
+        month_df = df_non_noise[codes == code]
+        if render != "bins" and len(month_df) > max_points_per_month:
+            month_df = month_df.sample(max_points_per_month, random_state=0)
+
+        cluster_ids = sorted(month_df["cluster"].unique())
+        color_map = {cid: COLORS[i % len(COLORS)] for i, cid in enumerate(cluster_ids)}
+
+        month_centroids = None
+        if centroids is not None and not centroids.empty:
+            month_centroids = centroids[centroids["cluster"].isin(cluster_ids)]
+            if "month" in month_centroids.columns:
+                # cluster IDs are per month, so only this month's centroids apply
+                month_centroids = month_centroids[month_centroids["month"].astype(str) == ym]
+
+        yield ym, month_df, color_map, month_centroids
 
 
 def make_maps_for_user(
@@ -12,63 +214,50 @@ def make_maps_for_user(
     output_dir: str = "maps",
     max_points_overall: int = 20000,
     max_points_per_month: int = 5000,
+    render: str = "canvas",
+    bin_meters: float = 25,
 ):
     """
     Generate one HTML with all months as tabs.
+
+    render="canvas" draws each month's points as a single columnar layer on a
+    canvas renderer; render="markers" creates one folium.CircleMarker per point;
+    render="bins" draws only grid cells of bin_meters with counts and dwell
+    hours per cluster, so no points are sampled away and page size depends on
+    the area covered rather than the number of fixes.
     """
+    if render not in ("canvas", "markers", "bins"):
+        raise ValueError(f"Unknown render mode: {render!r} (use 'canvas', 'markers' or 'bins')")
     os.makedirs(output_dir, exist_ok=True)
 
-    if not pd.api.types.is_datetime64_any_dtype(df["datetime"]):
-        df["datetime"] = pd.to_datetime(df["datetime"])
-
-    df_non_noise = df[df["cluster"] != -1].copy()
-    if df_non_noise.empty:
-        print(f"[mapping] No non-noise points for {user_name}, skipping maps.")
-        return
-
-    # Downscale overall
-    if len(df_non_noise) > max_points_overall:
-        df_non_noise = df_non_noise.sample(max_points_overall, random_state=0)
-
-    df_non_noise["year_month"] = df_non_noise["datetime"].dt.to_period("M").astype(str)
-    months = sorted(df_non_noise["year_month"].unique())
-
     # Create a separate Folium map for each month
     month_maps_html = {}
-    colors = [
-        "red", "blue", "green", "purple", "orange",
-        "darkred", "lightred", "beige", "darkblue",
-        "darkgreen", "cadetblue", "darkpurple", "white",
-        "pink", "lightblue", "lightgreen", "gray", "black",
-    ]
-
-    for ym in months:
-        month_df = df_non_noise[df_non_noise["year_month"] == ym].copy()
-        if len(month_df) > max_points_per_month:
-            month_df = month_df.sample(max_points_per_month, random_state=0)
-
+    for ym, month_df, color_map, month_centroids in _iter_months(
+        df, centroids, render, max_points_overall, max_points_per_month
+    ):
         center_lat = month_df["latitude"].mean()
         center_lon = month_df["longitude"].mean()
         m = folium.Map(location=[center_lat, center_lon], zoom_start=12)
 
-        cluster_ids = sorted(month_df["cluster"].unique())
-        color_map = {cid: colors[i % len(colors)] for i, cid in enumerate(cluster_ids)}
-
-        for _, row in month_df.iterrows():
-            cid = row["cluster"]
-            color = color_map.get(cid, "gray")
-            folium.CircleMarker(
-                location=[row["latitude"], row["longitude"]],
-                radius=3,
-                popup=f"Cluster {cid}<br>{row['datetime']}",
-                fill=True,
-                fill_opacity=0.7,
-                opacity=0.7,
-                color=color,
-            ).add_to(m)
+        if render == "bins":
+            CanvasLayer(bin_payload(month_df, color_map, bin_meters)).add_to(m)
+        elif render == "canvas":
+            CanvasLayer(point_payload(month_df, color_map)).add_to(m)
+        else:
+            for _, row in month_df.iterrows():
+                cid = row["cluster"]
+                color = color_map.get(cid, "gray")
+                folium.CircleMarker(
+                    location=[row["latitude"], row["longitude"]],
+                    radius=3,
+                    popup=f"Cluster {cid}<br>{row['datetime']}",
+                    fill=True,
+                    fill_opacity=0.7,
+                    opacity=0.7,
+                    color=color,
+                ).add_to(m)
 
-        if centroids is not None and not centroids.empty:
-            month_centroids = centroids[centroids["cluster"].isin(cluster_ids)]
+        if month_centroids is not None:
             for _, row in month_centroids.iterrows():
                 cid = row["cluster"]
                 folium.Marker(
@@ -79,6 +268,11 @@ def make_maps_for_user(
 
         month_maps_html[ym] = m._repr_html_()  # store HTML as string
 
+    if not month_maps_html:
+        print(f"[mapping] No non-noise points for {user_name}, skipping maps.")
+        return
+    months = list(month_maps_html)
+
     # Create final HTML with tabs
     tab_headers = "".join(
         f'<li class="nav-item"><a class="nav-link {"active" if i==0 else ""}" data-bs-toggle="tab" href="#tab{i}">{m}</a></li>'
@@ -112,4 +306,189 @@ def make_maps_for_user(
     out_path = os.path.join(output_dir, f"{user_name}_monthly_tabs.html")
     with open(out_path, "w", encoding="utf-8") as f:
         f.write(final_html)
-    print(f"[mapping] Saved tabbed monthly map: {out_path}")
\ No newline at end of file
+    print(f"[mapping] Saved tabbed monthly map: {out_path}")
+
+
+# ------------ LAZY-LOADING VIEWER ------------
+LAZY_PAGE = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>{user_name} Monthly Maps</title>
+<link href="https://cdn.jsdelivr.net/npm/bootstrap@5.3.1/dist/css/bootstrap.min.css" rel="stylesheet">
+<link href="https://unpkg.com/leaflet@1.9.4/dist/leaflet.css" rel="stylesheet">
+<script src="https://cdn.jsdelivr.net/npm/bootstrap@5.3.1/dist/js/bootstrap.bundle.min.js"></script>
+<script src="https://unpkg.com/leaflet@1.9.4/dist/leaflet.js"></script>
+<style>html, body {{height:100%; margin:0; padding:0;}} .month-map {{height:85vh;}}</style>
+</head>
+<body>
+<div class="container-fluid">
+  <h2>{user_name} Monthly Maps</h2>
+  <ul class="nav nav-tabs">{tab_headers}</ul>
+  <div class="tab-content">{tab_contents}</div>
+</div>
+<script>
+{draw_js}
+var MONTHS = {months};
+var DATA_DIR = {data_dir};
+window.monthData = {{}};
+var started = {{}};
+
+// fetch a month's data file and build its map the first time its tab is shown
+function loadMonth(i) {{
+    if (started[i]) return;
+    started[i] = true;
+    var script = document.createElement("script");
+    script.src = DATA_DIR + "/" + MONTHS[i] + ".js";
+    script.onload = function() {{ buildMap(i, window.monthData[MONTHS[i]]); }};
+    document.head.appendChild(script);
+}}
+
+function buildMap(i, data) {{
+    var map = L.map("map" + i).setView(data.center, 12);
+    L.tileLayer("https://{{s}}.tile.openstreetmap.org/{{z}}/{{x}}/{{y}}.png", {{
+        attribution: "&copy; OpenStreetMap contributors"
+    }}).addTo(map);
+    if (data.kind === "bins") {{
+        drawBins(map, data);
+    }} else {{
+        drawPoints(map, data);
+    }}
+    data.centroids.forEach(function(c) {{
+        var label = "Cluster " + c[0] + " (centroid)";
+        L.marker([c[1], c[2]]).bindTooltip(label).bindPopup(label).addTo(map);
+    }});
+}}
+
+document.querySelectorAll('a[data-bs-toggle="tab"]').forEach(function(a) {{
+    a.addEventListener("shown.bs.tab", function() {{ loadMonth(Number(a.dataset.index)); }});
+}});
+if (MONTHS.length) loadMonth(0);
+</script>
+</body>
+</html>
+"""
+
+
+def _month_data_dir(user_name, output_dir):
+    return os.path.join(output_dir, f"{user_name}_months")
+
+
+def write_month_data(user_name: str, year_month: str, payload: dict, output_dir: str = "maps"):
+    """Write one month's payload as a small script the lazy viewer loads on demand."""
+    month_dir = _month_data_dir(user_name, output_dir)
+    os.makedirs(month_dir, exist_ok=True)
+    path = os.path.join(month_dir, f"{year_month}.js")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(f"window.monthData[{json.dumps(year_month)}] = {_to_json(payload)};\n")
+    return path
+
+
+def list_month_data(user_name: str, output_dir: str = "maps"):
+    """Months ('YYYY-MM') that have a data file for the user, sorted."""
+    month_dir = _month_data_dir(user_name, output_dir)
+    if not os.path.isdir(month_dir):
+        return []
+    return sorted(f[:-3] for f in os.listdir(month_dir) if f.endswith(".js"))
+
+
+def remove_month_data(user_name: str, months, output_dir: str = "maps"):
+    """Delete the data files of `months` so the shell page stops listing them; returns those removed."""
+    month_dir = _month_data_dir(user_name, output_dir)
+    removed = []
+    for ym in sorted(months):
+        path = os.path.join(month_dir, f"{ym}.js")
+        if os.path.exists(path):
+            os.remove(path)
+            removed.append(ym)
+    return removed
+
+
+def write_lazy_page(user_name: str, output_dir: str = "maps"):
+    """
+    Write the viewer shell page listing every month data file present for
+    the user. The page holds no map data itself.
+    """
+    month_dir = _month_data_dir(user_name, output_dir)
+    months = list_month_data(user_name, output_dir)
+
+    tab_headers = "".join(
+        f'<li class="nav-item"><a class="nav-link {"active" if i==0 else ""}" data-bs-toggle="tab" '
+        f'data-index="{i}" href="#tab{i}">{m}</a></li>'
+        for i, m in enumerate(months)
+    )
+    tab_contents = "".join(
+        f'<div class="tab-pane fade {"show active" if i==0 else ""}" id="tab{i}">'
+        f'<div class="month-map" id="map{i}"></div></div>'
+        for i, m in enumerate(months)
+    )
+    page = LAZY_PAGE.format(
+        user_name=user_name,
+        tab_headers=tab_headers,
+        tab_contents=tab_contents,
+        draw_js=DRAW_JS,
+        months=json.dumps(months),
+        data_dir=json.dumps(os.path.basename(month_dir)),
+    )
+
+    out_path = os.path.join(output_dir, f"{user_name}_viewer.html")
+    with open(out_path, "w", encoding="utf-8") as f:
+        f.write(page)
+    return out_path
+
+
+def make_lazy_maps_for_user(
+    user_name: str,
+    df: pd.DataFrame,
+    centroids: Optional[pd.DataFrame] = None,
+    output_dir: str = "maps",
+    max_points_overall: int = 20000,
+    max_points_per_month: int = 5000,
+    render: str = "bins",
+    bin_meters: float = 25,
+    months: Optional[list] = None,
+):
+    """
+    Generate a lazy-loading viewer: a small shell page plus one data file per
+    month under maps/<user>_months/. A month's map is only built when its tab
+    is opened.
+
+    Pass `months` (e.g. ["2018-11"]) to regenerate just those data files; the
+    shell page is then only rewritten if a month is new to it or gone. Data
+    files of months with nothing left to show are deleted: every month not
+    written on a full run, the requested ones without points otherwise.
+    """
+    if render not in ("canvas", "bins"):
+        raise ValueError(f"Unknown render mode for the lazy viewer: {render!r} (use 'canvas' or 'bins')")
+
+    existing = set(list_month_data(user_name, output_dir))
+
+    written = []
+    for ym, month_df, color_map, month_centroids in _iter_months(
+        df, centroids, render, max_points_overall, max_points_per_month, only_months=months
+    ):
+        if render == "bins":
+            payload = bin_payload(month_df, color_map, bin_meters)
+        else:
+            payload = point_payload(month_df, color_map)
+        payload["center"] = [float(month_df["latitude"].mean()), float(month_df["longitude"].mean())]
+        payload["centroids"] = [] if month_centroids is None else [
+            [int(row.cluster), float(row.centroid_lat), float(row.centroid_lon)]
+            for row in month_centroids.itertuples()
+        ]
+        write_month_data(user_name, ym, payload, output_dir)
+        written.append(ym)
+
+    stale = existing - set(written) if months is None else (existing & set(months)) - set(written)
+    removed = remove_month_data(user_name, stale, output_dir)
+
+    if not written and not removed:
+        print(f"[mapping] No non-noise points for {user_name}, skipping maps.")
+        return
+
+    if months is None or removed or not set(written) <= existing:
+        out_path = write_lazy_page(user_name, output_dir)
+        print(f"[mapping] Saved lazy monthly viewer: {out_path} ({len(written)} month files"
+              + (f", removed {', '.join(removed)})" if removed else ")"))
+    else:
+        print(f"[mapping] Updated {len(written)} month file(s) for {user_name}: {', '.join(written)}")
@@ -0,0 +1,142 @@
+# partitioned.py
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+import pandas as pd
+from data_load import GPS_DTYPES, iter_gps_chunks, compact_points, month_codes, month_label, filter_trajectory
+from clustering import cluster_locations_per_month, resolve_workers
+from analysis import build_dwell_facts, segment_visits, point_counts, cluster_extents
+from instrumentation import span
+from point_store import drop_index, write_month, write_index, load_index, iter_points, read_points
+
+SPILL_DIR = "_spill"
+
+
+# ------------ CLEANING ------------
+def partition_gps_csv(file, user, root, max_accuracy=50, chunksize=500_000,
+                      max_speed_kmh=None, dedup_meters=None, stats=None):
+    """
+    Clean one raw CSV into a month-partitioned store (see point_store) without
+    ever holding the whole file: cleaned chunks are spilled to per-month
+    files, then each month is sorted, trajectory-filtered and written as its
+    partition. Rows end up exactly as read_gps_csv leaves them, as the
+    filters never look across a month boundary. Returns the store index.
+    """
+    spill = os.path.join(root, user, SPILL_DIR)
+    shutil.rmtree(spill, ignore_errors=True)
+    old = drop_index(user, root)
+
+    original_rows = 0
+    for i, (raw_rows, chunk) in enumerate(iter_gps_chunks(file, max_accuracy, chunksize)):
+        original_rows += raw_rows
+        codes = month_codes(chunk["datetime"])
+        for code in np.unique(codes):
+            path = os.path.join(spill, month_label(code), f"chunk-{i:05d}.parquet")
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            chunk[codes == code].to_parquet(path, index=False)
+
+    months = {}
+    counts = {}
+    for label in sorted(os.listdir(spill)) if os.path.isdir(spill) else []:
+        month_dir = os.path.join(spill, label)
+        df = pd.concat([pd.read_parquet(os.path.join(month_dir, f)) for f in sorted(os.listdir(month_dir))],
+                       ignore_index=True)
+        df = compact_points(df.sort_values("datetime", kind="stable").reset_index(drop=True))
+        month_counts = {}
+        df = filter_trajectory(df, max_speed_kmh, dedup_meters, month_counts)
+        for name, n in month_counts.items():
+            counts[name] = counts.get(name, 0) + n
+        write_month(user, root, label, df)
+        months[label] = len(df)
+    shutil.rmtree(spill, ignore_errors=True)
+
+    index = write_index(user, root, months, ["datetime", *GPS_DTYPES], old)
+    if stats is not None:
+        stats.update(counts)
+    print(
+        f"Partitioned GPS: {original_rows} -> {sum(months.values())} rows in {len(months)} months "
+        f"(accuracy <= {max_accuracy}, chunksize={chunksize}"
+        + "".join(f", -{n} {name}" for name, n in counts.items()) + ")"
+    )
+    return index
+
+
+# ------------ CLUSTERING ------------
+def _cluster_partition(user, clean_root, out_root, month, cluster_kwargs):
+    """Worker: read one cleaned month, cluster it and write its clustered partition."""
+    df = read_points(user, clean_root, months=[month])
+    stats = []
+    clustered, score = cluster_locations_per_month(df, n_jobs=1, eval_jobs=0, month_stats=stats,
+                                                   **cluster_kwargs)
+    write_month(user, out_root, month, clustered)
+    return len(clustered), score, stats
+
+
+def cluster_partitions(user, clean_root, out_root, n_jobs=1, month_stats=None, **cluster_kwargs):
+    """
+    Out-of-core cluster_locations_per_month: every month partition of the
+    cleaned store is read, clustered and written to the clustered store by
+    its own task, so at most `n_jobs` months are in memory at once. Months
+    are clustered independently either way, so labels match the in-memory
+    run. Returns the average DBCV score over the scored months (or None);
+    `month_stats` collects cluster_locations_per_month's per-month records.
+    """
+    months = load_index(user, clean_root)["months"]
+    old = drop_index(user, out_root)
+
+    results = {}
+    n_workers = resolve_workers(n_jobs, len(months))
+    if n_workers == 1:
+        for month in sorted(months):
+            results[month] = _cluster_partition(user, clean_root, out_root, month, cluster_kwargs)
+    else:
+        with ProcessPoolExecutor(max_workers=n_workers) as pool:
+            # largest months first so a big month doesn't start last
+            futures = {
+                pool.submit(_cluster_partition, user, clean_root, out_root, month, cluster_kwargs): month
+                for month in sorted(months, key=lambda m: -months[m])
+            }
+            for fut in as_completed(futures):
+                results[futures[fut]] = fut.result()
+
+    write_index(user, out_root, {m: rows for m, (rows, _, _) in results.items()},
+                ["datetime", *GPS_DTYPES, "cluster"], old)
+    if month_stats is not None:
+        for month in sorted(results):
+            month_stats.extend(results[month][2])
+    scores = [score for _, score, _ in results.values() if score is not None]
+    return sum(scores) / len(scores) if scores else None
+
+
+# ------------ ANALYSIS ------------
+def summarize_partitions(user, root, columns=None, run_log=None):
+    """
+    Stream a clustered store one month at a time into the user-level inputs
+    of the report: the dwell fact table, the visit table, the point
+    counts (as analysis.point_counts) and the cluster extents. Dwell and
+    visits already break at month boundaries and extents are per month, so
+    the combined tables equal the in-memory ones. With a RunLog each month is recorded as its own span.
+    """
+    facts, visits, extents = [], [], []
+    counts = {"total_points": 0, "noise": 0, "clusters": set()}
+    for month, part in iter_points(user, root, columns):
+        with span(run_log, user, "analyze", "month", month=month, points_in=len(part)) as record:
+            facts.append(build_dwell_facts(part))
+            month_visits = segment_visits(part)
+            if not month_visits.empty:
+                visits.append(month_visits)
+            month_counts = point_counts(part)
+            extents.append(cluster_extents(part))
+            record["points_out"] = len(facts[-1])
+        counts["total_points"] += month_counts["total_points"]
+        counts["noise"] += month_counts["noise"]
+        counts["clusters"] |= month_counts["clusters"]
+
+    return {
+        "facts": pd.concat(facts, ignore_index=True),
+        "visits": (pd.concat(visits, ignore_index=True) if visits
+                   else pd.DataFrame(columns=["month", "cluster", "start", "end", "duration_hours", "points"])),
+        "counts": counts,
+        "extents": pd.concat(extents, ignore_index=True),
+    }
@@ -0,0 +1,145 @@
+# pipeline.py
+import os
+import json
+import hashlib
+from instrumentation import count_points, span
+
+PIPELINE_DIR = "pipeline_state"
+
+# Each stage lists the stages it reads from. Order matters: it is the run order.
+STAGE_GRAPH = {
+    "load": [],
+    "clean": ["load"],
+    "cluster": ["clean"],
+    "index": ["cluster"],
+    "analyze": ["cluster"],
+    "report": ["analyze"],
+    "plot": ["analyze"],
+    "map": ["cluster", "analyze"],
+}
+
+
+def _digest(obj):
+    return hashlib.sha1(json.dumps(obj, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def source_key(file):
+    """Identity of a raw input file: path, size and modification time."""
+    st = os.stat(file)
+    return {"source": os.path.abspath(file), "size": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+
+def stage_keys(source, params):
+    """
+    Hash key of every stage's artifact for one user: the stage's own
+    parameters plus the keys of the stages it depends on. A change anywhere
+    upstream therefore changes every key downstream of it.
+    """
+    keys = {}
+    for stage, deps in STAGE_GRAPH.items():
+        keys[stage] = _digest({
+            "stage": stage,
+            "params": params.get(stage),
+            "deps": [keys[d] for d in deps],
+            "source": source if not deps else None,
+        })
+    return keys
+
+
+def _state_path(user, state_dir):
+    return os.path.join(state_dir, f"{user}.json")
+
+
+def load_state(user, state_dir=PIPELINE_DIR):
+    """{stage: key} recorded for the artifacts currently on disk."""
+    path = _state_path(user, state_dir)
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def record_stage(user, stage, key, state_dir=PIPELINE_DIR):
+    """Mark one stage's artifact as built for `key` (called after it is written)."""
+    os.makedirs(state_dir, exist_ok=True)
+    state = load_state(user, state_dir)
+    state[stage] = key
+    with open(_state_path(user, state_dir), "w", encoding="utf-8") as f:
+        json.dump(state, f, indent=1, sort_keys=True)
+
+
+def plan_user(user, keys, stages, state_dir=PIPELINE_DIR, force=()):
+    """
+    Which stages must run for one user, with the reason for each.
+
+    `stages` maps stage name -> spec dict; a spec's optional "outputs"
+    callable returns the artifact paths for a user, and a stage is stale if
+    any is missing. Returns an ordered {stage: reason} of stale stages only.
+    """
+    state = load_state(user, state_dir)
+    stale = {}
+    for stage in STAGE_GRAPH:
+        outputs = stages[stage].get("outputs")
+        if stage in force:
+            stale[stage] = "forced"
+        elif stage not in state:
+            stale[stage] = "never built"
+        elif any(d in stale for d in STAGE_GRAPH[stage]):
+            stale[stage] = "upstream changed"
+        elif state[stage] != keys[stage]:
+            stale[stage] = "parameters or inputs changed"
+        elif outputs is not None and not all(os.path.exists(p) for p in outputs(user)):
+            stale[stage] = "artifact missing"
+    return stale
+
+
+def run_user(user, source, params, stages, state_dir=PIPELINE_DIR, force=(), dry_run=False,
+             run_log=None):
+    """
+    Bring one user's artifacts up to date.
+
+    Each spec has "run": fn(ctx) -> value for stale stages and "load":
+    fn(ctx) -> value to read a fresh stage's artifact back when a stale stage
+    downstream needs it. ctx holds "user", "source", "plan", "run_log" and the
+    value of every stage run or loaded so far. With a RunLog every load and
+    run is recorded with the points going in and out. Returns the plan
+    ({stage: reason}).
+    """
+    keys = stage_keys(source_key(source), params)
+    plan = plan_user(user, keys, stages, state_dir, force)
+    if dry_run or not plan:
+        return plan
+
+    ctx = {"user": user, "source": source, "plan": plan, "run_log": run_log}
+
+    todo = [stage for stage in STAGE_GRAPH if stage in plan]
+    for i, stage in enumerate(todo):
+        # artifacts are read straight from disk, so only direct inputs are loaded
+        for dep in STAGE_GRAPH[stage]:
+            if dep not in ctx:
+                with span(run_log, user, dep, "load") as record:
+                    ctx[dep] = stages[dep]["load"](ctx)
+                    record["points_out"] = count_points(ctx[dep])
+        with span(run_log, user, stage, "run") as record:
+            deps = STAGE_GRAPH[stage]
+            record["points_in"] = count_points(ctx[deps[0]]) if deps else None
+            ctx[stage] = stages[stage]["run"](ctx)
+            record["points_out"] = count_points(ctx[stage])
+        record_stage(user, stage, keys[stage], state_dir)
+
+        # drop frames no remaining stage reads, as soon as their artifact is on disk
+        still_needed = {d for later in todo[i + 1:] for d in STAGE_GRAPH[later]}
+        for done in STAGE_GRAPH:
+            if done in ctx and done not in still_needed:
+                del ctx[done]
+    return plan
+
+
+def print_plan(plans):
+    """Dry-run listing: {user: {stage: reason}} -> one line per stale stage."""
+    for user, plan in plans.items():
+        if not plan:
+            print(f"{user}: up to date")
+            continue
+        for stage, reason in plan.items():
+            print(f"{user}: {stage:<8} ({reason})")
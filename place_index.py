@@ -0,0 +1,204 @@
+# place_index.py
+import os
+import json
+import numpy as np
+import pandas as pd
+from scipy.spatial import cKDTree
+from data_load import month_codes, month_label, month_code_of, EARTH_RADIUS_M
+
+PLACE_INDEX_DIR = "place_index"
+INDEX_FILE = "_months.json"
+
+
+def cluster_exemplars(df, cell_meters=10, max_per_cluster=500, seed=0):
+    """
+    Exemplar points of every cluster in one month of clustered points: the
+    mean position of each occupied `cell_meters` grid cell per cluster,
+    thinned to at most `max_per_cluster` cells (seeded). Noise is skipped.
+    Returns (coords in radians, float64 (n, 2); cluster labels, int32).
+    """
+    labels = df["cluster"].to_numpy()
+    keep = labels != -1
+    labels = labels[keep].astype(np.int64)
+    if not len(labels):
+        return np.empty((0, 2)), np.empty(0, dtype=np.int32)
+    coords = np.radians(df[["latitude", "longitude"]].to_numpy(dtype=np.float64)[keep])
+
+    lat0 = float(np.mean(coords[:, 0]))
+    rows = np.floor(coords[:, 0] * EARTH_RADIUS_M / cell_meters).astype(np.int64)
+    cols = np.floor(coords[:, 1] * EARTH_RADIUS_M * np.cos(lat0) / cell_meters).astype(np.int64)
+    # one int64 key per (cluster, row, col): a 1-D unique is far cheaper than axis=0
+    rows -= rows.min()
+    cols -= cols.min()
+    n_rows, n_cols = int(rows.max()) + 1, int(cols.max()) + 1
+    keys, cell_of_point, counts = np.unique(
+        (labels * n_rows + rows) * n_cols + cols, return_inverse=True, return_counts=True
+    )
+    centers = np.empty((len(keys), 2))
+    centers[:, 0] = np.bincount(cell_of_point, weights=coords[:, 0], minlength=len(keys)) / counts
+    centers[:, 1] = np.bincount(cell_of_point, weights=coords[:, 1], minlength=len(keys)) / counts
+    cell_labels = keys // (n_rows * n_cols)
+
+    # keep each cluster's busiest cells first when thinning
+    rng = np.random.default_rng(seed)
+    order = np.lexsort((rng.random(len(keys)), -counts, cell_labels))
+    rank = np.arange(len(order)) - np.searchsorted(cell_labels[order], cell_labels[order])
+    chosen = order[rank < max_per_cluster]
+    return centers[chosen], cell_labels[chosen].astype(np.int32)
+
+
+def _unit_vectors(lat, lon):
+    """Points on the unit sphere for latitudes/longitudes in radians."""
+    cos_lat = np.cos(lat)
+    return np.column_stack([cos_lat * np.cos(lon), cos_lat * np.sin(lon), np.sin(lat)])
+
+
+class PlaceIndex:
+    """
+    Nearest-exemplar lookup for one month's clusters. A fix gets the label of
+    its nearest exemplar if that is within max_distance_m, else -1 (noise).
+
+    The tree is a KD-tree over unit-sphere vectors: chord length is monotonic
+    in great-circle distance, so the nearest exemplar is the same as with a
+    haversine BallTree, and Euclidean queries bounded by max_distance_m are
+    several times faster (fixes with nothing in range stop early).
+    """
+
+    def __init__(self, exemplars, labels, max_distance_m=50):
+        self.exemplars = np.asarray(exemplars, dtype=np.float64).reshape(-1, 2)
+        self.labels = np.asarray(labels, dtype=np.int32)
+        self.max_distance_m = float(max_distance_m)
+        self._max_chord = 2 * np.sin(min(self.max_distance_m / EARTH_RADIUS_M, np.pi) / 2)
+        self._tree = None
+        if len(self.labels):
+            self._tree = cKDTree(_unit_vectors(self.exemplars[:, 0], self.exemplars[:, 1]))
+
+    def assign(self, lat, lon):
+        """Cluster label (or -1) for arrays of latitudes/longitudes in degrees."""
+        lat = np.radians(np.atleast_1d(np.asarray(lat, dtype=np.float64)))
+        lon = np.radians(np.atleast_1d(np.asarray(lon, dtype=np.float64)))
+        if self._tree is None:
+            return np.full(len(lat), -1, dtype=np.int32)
+        # out of range: infinite distance and idx == number of exemplars
+        _, idx = self._tree.query(_unit_vectors(lat, lon), distance_upper_bound=self._max_chord)
+        return np.append(self.labels, np.int32(-1))[idx]
+
+    def assign_one(self, lat, lon):
+        """Cluster label (or -1) of a single fix."""
+        if self._tree is None:
+            return -1
+        lat, lon = np.radians(lat), np.radians(lon)
+        cos_lat = np.cos(lat)
+        _, idx = self._tree.query([cos_lat * np.cos(lon), cos_lat * np.sin(lon), np.sin(lat)],
+                                  distance_upper_bound=self._max_chord)
+        return int(self.labels[idx]) if idx < len(self.labels) else -1
+
+
+# ------------ PERSISTENCE ------------
+def _month_path(user, month, root):
+    return os.path.join(root, user, f"{month}.npz")
+
+
+def index_manifest_path(user, root=PLACE_INDEX_DIR):
+    """Written after every month file, so its presence means the indexes are complete."""
+    return os.path.join(root, user, INDEX_FILE)
+
+
+def save_place_index(user, month, index, root=PLACE_INDEX_DIR):
+    path = _month_path(user, month, root)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + ".tmp", "wb") as f:
+        np.savez(f, exemplars=index.exemplars, labels=index.labels, max_distance_m=index.max_distance_m)
+    os.replace(path + ".tmp", path)
+
+
+def load_place_index(user, month, root=PLACE_INDEX_DIR):
+    with np.load(_month_path(user, month, root)) as data:
+        return PlaceIndex(data["exemplars"], data["labels"], float(data["max_distance_m"]))
+
+
+def build_place_indexes(user, months, root=PLACE_INDEX_DIR, max_distance_m=50, **exemplar_kwargs):
+    """
+    Build and save one PlaceIndex per month from (month, clustered frame)
+    pairs, e.g. point_store.iter_points or a frame grouped by month, then
+    write the manifest of indexed months. Returns {month: exemplar count}.
+    """
+    built = {}
+    for month, month_df in months:
+        exemplars, labels = cluster_exemplars(month_df, **exemplar_kwargs)
+        save_place_index(user, month, PlaceIndex(exemplars, labels, max_distance_m), root)
+        built[month] = int(len(labels))
+
+    # months that are no longer clustered lose their index
+    user_dir = os.path.join(root, user)
+    for f in os.listdir(user_dir) if os.path.isdir(user_dir) else []:
+        if f.endswith(".npz") and f[:-4] not in built:
+            os.remove(os.path.join(user_dir, f))
+    os.makedirs(user_dir, exist_ok=True)
+    with open(index_manifest_path(user, root), "w", encoding="utf-8") as f:
+        json.dump({"max_distance_m": max_distance_m, "months": built}, f, indent=1, sort_keys=True)
+    return built
+
+
+def iter_month_frames(df):
+    """(month label, rows) of a clustered frame, in month order, for build_place_indexes."""
+    codes = month_codes(df["datetime"]) if "month" not in df.columns else df["month"].to_numpy()
+    order = np.argsort(codes, kind="stable")
+    uniq, starts = np.unique(codes[order], return_index=True)
+    for code, pos in zip(uniq, np.split(order, starts[1:])):
+        yield month_label(code), df.iloc[pos]
+
+
+class PlaceAssigner:
+    """
+    Label live fixes for one user without reclustering. Each fix uses the
+    index of its own month or, for a month not clustered yet, of the most
+    recent earlier month. Month indexes are loaded on first use and kept.
+    """
+
+    def __init__(self, user, root=PLACE_INDEX_DIR):
+        with open(index_manifest_path(user, root), "r", encoding="utf-8") as f:
+            self.months = sorted(json.load(f)["months"])
+        self.user = user
+        self.root = root
+        self._codes = np.array([month_code_of(m) for m in self.months], dtype=np.int64)
+        self._loaded = {}
+
+    def _index(self, month):
+        if month not in self._loaded:
+            self._loaded[month] = load_place_index(self.user, month, self.root)
+        return self._loaded[month]
+
+    def month_for(self, code):
+        """Indexed month used for a month code, or None if it predates them all."""
+        i = np.searchsorted(self._codes, code, side="right") - 1
+        return self.months[i] if i >= 0 else None
+
+    def assign(self, datetimes, lat, lon):
+        """
+        Labels for a batch of fixes; returns a frame with the month whose
+        clusters were used ('month', None if no index applies) and 'cluster'.
+        """
+        dt = pd.Series(pd.to_datetime(np.atleast_1d(datetimes)))
+        lat = np.atleast_1d(np.asarray(lat, dtype=np.float64))
+        lon = np.atleast_1d(np.asarray(lon, dtype=np.float64))
+        codes = month_codes(dt)
+
+        labels = np.full(len(codes), -1, dtype=np.int32)
+        used = np.empty(len(codes), dtype=object)
+        for code in np.unique(codes):
+            month = self.month_for(code)
+            if month is None:
+                continue
+            rows = codes == code
+            labels[rows] = self._index(month).assign(lat[rows], lon[rows])
+            used[rows] = month
+        return pd.DataFrame({"month": used, "cluster": labels})
+
+    def assign_one(self, datetime, lat, lon):
+        """(month used, cluster label) for a single fix."""
+        ts = pd.Timestamp(datetime)
+        month = self.month_for(ts.year * 12 + ts.month - 1)
+        if month is None:
+            return None, -1
+        return month, self._index(month).assign_one(lat, lon)
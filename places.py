@@ -0,0 +1,99 @@
+# places.py
+import numpy as np
+import pandas as pd
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+from data_load import EARTH_RADIUS_M, haversine_m
+
+REGISTRY_COLUMNS = ["month", "cluster", "place", "centroid_lat", "centroid_lon", "points", "radius_m"]
+
+
+def _candidate_pairs(lat, lon, radius, cell_meters):
+    """
+    (i, j) pairs, i < j, of extents whose bounding boxes share a grid cell.
+
+    Each extent is hashed into every cell its box covers and the cell lists
+    are self-joined, so the work grows with the number of extents and their
+    local overlap, not with all pairs. Boxes are widened in x by
+    cos(lat0) / cos(lat) so the shared projection never misses a true pair.
+    """
+    lat0 = np.radians(np.mean(lat))
+    y = np.radians(lat) * EARTH_RADIUS_M
+    x = np.radians(lon - np.mean(lon)) * EARTH_RADIUS_M * np.cos(lat0)
+    rx = radius * np.cos(lat0) / np.maximum(np.cos(np.radians(lat)), 1e-6)
+
+    x0, x1 = np.floor((x - rx) / cell_meters).astype(np.int64), np.floor((x + rx) / cell_meters).astype(np.int64)
+    y0, y1 = np.floor((y - radius) / cell_meters).astype(np.int64), np.floor((y + radius) / cell_meters).astype(np.int64)
+    nx, ny = x1 - x0 + 1, y1 - y0 + 1
+
+    # one row per (extent, covered cell)
+    owner = np.repeat(np.arange(len(lat)), nx * ny)
+    offset = np.arange(len(owner)) - np.repeat(np.cumsum(nx * ny) - nx * ny, nx * ny)
+    cx = x0[owner] + offset % nx[owner]
+    cy = y0[owner] + offset // nx[owner]
+    cells = pd.DataFrame({"cx": cx, "cy": cy, "i": owner})
+
+    pairs = cells.merge(cells.rename(columns={"i": "j"}), on=["cx", "cy"])
+    pairs = pairs[pairs["i"] < pairs["j"]]
+    return np.unique(np.column_stack([pairs["i"].to_numpy(), pairs["j"].to_numpy()]), axis=0).reshape(-1, 2)
+
+
+def link_places(extents, link_meters=50, max_radius_m=250):
+    """
+    Link a user's monthly clusters (analysis.cluster_extents) into places
+    that persist across months.
+
+    Two clusters of different months are the same place when their extents
+    overlap: centroid distance <= the sum of their radii, each radius
+    clamped to [link_meters / 2, max_radius_m] so small clusters still link
+    within link_meters and a sprawling one cannot swallow a neighbourhood.
+    Places are the connected components of those links; clusters of the
+    same month are never linked directly. Place IDs are numbered in order of
+    first appearance (month, then cluster). Returns the extents with a
+    'place' column, in REGISTRY_COLUMNS order.
+    """
+    registry = extents.sort_values(["month", "cluster"], kind="stable").reset_index(drop=True)
+    n = len(registry)
+    if n == 0:
+        return registry.assign(place=pd.Series(dtype="int32"))[REGISTRY_COLUMNS]
+
+    lat = registry["centroid_lat"].to_numpy(dtype=np.float64)
+    lon = registry["centroid_lon"].to_numpy(dtype=np.float64)
+    radius = np.clip(registry["radius_m"].to_numpy(dtype=np.float64), link_meters / 2, max_radius_m)
+    month = registry["month"].to_numpy()
+
+    pairs = _candidate_pairs(lat, lon, radius, cell_meters=max(link_meters, 1))
+    i, j = pairs[:, 0], pairs[:, 1]
+    linked = (month[i] != month[j]) & (haversine_m(lat[i], lon[i], lat[j], lon[j]) <= radius[i] + radius[j])
+
+    graph = coo_matrix((np.ones(linked.sum(), dtype=np.int8), (i[linked], j[linked])), shape=(n, n))
+    _, component = connected_components(graph, directed=False)
+    # rows are in (month, cluster) order, so first-occurrence order is first appearance
+    _, first = np.unique(component, return_index=True)
+    rank = np.empty(len(first), dtype=np.int32)
+    rank[np.argsort(first)] = np.arange(len(first), dtype=np.int32)
+    registry["place"] = rank[component]
+    return registry[REGISTRY_COLUMNS]
+
+
+def attach_places(table, registry):
+    """Add a 'place' column to any table keyed by (month, cluster); noise stays -1."""
+    lookup = registry[["month", "cluster", "place"]].astype({"cluster": table["cluster"].dtype})
+    out = table.merge(lookup, on=["month", "cluster"], how="left")
+    out["place"] = out["place"].fillna(-1).astype(np.int32)
+    return out
+
+
+def place_summary(registry):
+    """One row per place: months seen, clusters linked, points and weighted centroid."""
+    weighted = registry.assign(
+        lat_w=registry["centroid_lat"] * registry["points"],
+        lon_w=registry["centroid_lon"] * registry["points"],
+    )
+    summary = weighted.groupby("place").agg(
+        first_month=("month", "min"), last_month=("month", "max"), months=("month", "nunique"),
+        clusters=("cluster", "size"), points=("points", "sum"), lat_w=("lat_w", "sum"), lon_w=("lon_w", "sum"),
+    )
+    summary["centroid_lat"] = summary.pop("lat_w") / summary["points"]
+    summary["centroid_lon"] = summary.pop("lon_w") / summary["points"]
+    return summary.reset_index()
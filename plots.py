@@ -1,14 +1,23 @@
 # plots.py
 import pandas as pd
+import matplotlib
+matplotlib.use("Agg")  # no display needed; also safe inside worker processes
 import matplotlib.pyplot as plt
 import re
 import os
+import json
+import hashlib
 
 REPORT_DIR = "reports"
 PLOT_DIR = "plots"
+PLOT_VERSION = 2  # bump when the figure layout changes so every PNG is redrawn
 os.makedirs(PLOT_DIR, exist_ok=True)
 
-def plot_user_combined(report_file: str, save_dir: str = PLOT_DIR):
+def parse_report_text(report_file: str) -> dict:
+    """
+    Recover a report dict (see load_report_json) from a legacy *_report.txt.
+    Hours only have the one decimal the text report kept.
+    """
     username = os.path.basename(report_file).replace("_report.txt", "")
 
     # --- Read report ---
@@ -16,44 +25,99 @@ def plot_user_combined(report_file: str, save_dir: str = PLOT_DIR):
         lines = f.readlines()
 
     # --- Extract summary metrics ---
-    total_points = non_noise = noise = clusters = None
+    summary = {}
     for line in lines:
         L = line.lower()
         if "total points" in L:
-            total_points = re.search(r"(\d[\d,]*)", line).group(1)
+            summary["total_points"] = re.search(r"(\d[\d,]*)", line).group(1)
         elif "non-noise" in L:
-            non_noise = re.search(r"(\d[\d,]*)", line).group(1)
+            summary["non_noise"] = re.search(r"(\d[\d,]*)", line).group(1)
         elif "noise points" in L:
-            noise = re.search(r"(\d[\d,]*)", line).group(1)
+            summary["noise"] = re.search(r"(\d[\d,]*)", line).group(1)
         elif "detected clusters" in L or "clusters detected" in L:
-            clusters = re.search(r"(\d+)", line).group(1)
-
-    summary_table = [
-        ["Total Points", total_points],
-        ["Non-Noise Points", non_noise],
-        ["Noise Points", noise],
-        ["Detected Clusters", clusters],
-    ]
+            summary["n_clusters"] = re.search(r"(\d+)", line).group(1)
+        elif "linked places" in L:
+            summary["n_places"] = re.search(r"(\d+)", line).group(1)
 
     # --- Extract monthly data ---
-    month_data = {}
-    month_cluster_ids = {}
+    monthly_top = {}
     for line in lines:
         match = re.match(r"(\d{4}-\d{2}): (.+)", line)
         if match:
             month = match.group(1)
-            clusters_str = match.group(2).split(", ")
-            hours = []
-            cids = []
-            for c in clusters_str:
+            rows = []
+            for c in match.group(2).split(", "):
                 h_match = re.search(r"\(([\d\.]+)h\)", c)
                 cid_match = re.match(r"([\d\.]+)\(", c)
-                if h_match:
-                    hours.append(float(h_match.group(1)))
-                if cid_match:
-                    cids.append(cid_match.group(1))
-            month_data[month] = hours
-            month_cluster_ids[month] = cids
+                if h_match and cid_match:
+                    rows.append({"cluster": cid_match.group(1), "hours": float(h_match.group(1))})
+            monthly_top[month] = rows
+
+    # --- Extract weekday/weekend data ---
+    weekday_line = [l for l in lines if l.startswith("Weekdays:")]
+    weekend_line = [l for l in lines if l.startswith("Weekends:")]
+
+    weekday_parts = re.findall(r"([\d\.]+)\(([\d\.]+)h\)", weekday_line[0]) if weekday_line else []
+    weekend_parts = re.findall(r"([\d\.]+)\(([\d\.]+)h\)", weekend_line[0]) if weekend_line else []
+
+    return {
+        "user": username,
+        "summary": summary,
+        "monthly_top": monthly_top,
+        "weekday": [{"place": cid, "hours": float(h)} for cid, h in weekday_parts],
+        "weekend": [{"place": cid, "hours": float(h)} for cid, h in weekend_parts],
+        "transitions": [],
+    }
+
+
+def load_report_json(report_file: str) -> dict:
+    """
+    Read a structured report written by main.save_user_report_json:
+    {"user", "summary", "monthly_top": {month: [{"cluster", "hours"}]},
+     "weekday"/"weekend": [{"place", "hours"}],
+     "transitions": [{"place", "next_place", "count"}]}.
+    """
+    with open(report_file, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _cluster_label(cid) -> str:
+    """Cluster IDs print the same whether they came from JSON (int) or text ("48.0")."""
+    return str(int(float(cid)))
+
+
+def load_report(report_file: str) -> dict:
+    """A user's *_report.json if present, else the parsed *_report.txt."""
+    json_file = report_file.replace("_report.txt", "_report.json")
+    if os.path.exists(json_file):
+        return load_report_json(json_file)
+    return parse_report_text(report_file)
+
+
+def plot_user_combined(report_file: str, save_dir: str = PLOT_DIR):
+    """Plot one user from a *_report.json, or from a *_report.txt if that's all there is."""
+    plot_user_data(load_report(report_file), save_dir)
+
+
+def plot_user_data(report: dict, save_dir: str = PLOT_DIR):
+    """Draw the combined figure for one user straight from a report dict."""
+    username = report["user"]
+    summary = report["summary"]
+
+    summary_table = [
+        ["Total Points", summary.get("total_points")],
+        ["Non-Noise Points", summary.get("non_noise")],
+        ["Noise Points", summary.get("noise")],
+        ["Detected Clusters", summary.get("n_clusters")],
+        ["Linked Places", summary.get("n_places")],
+    ]
+
+    # --- Monthly data ---
+    month_data = {m: [r["hours"] for r in rows] for m, rows in report["monthly_top"].items()}
+    month_cluster_ids = {
+        m: [_cluster_label(r["cluster"]) for r in rows] for m, rows in report["monthly_top"].items()
+    }
+    month_data = {m: h for m, h in month_data.items() if h}
 
     if not month_data:
         print(f"No monthly data found for {username}")
@@ -74,19 +138,13 @@ def plot_user_combined(report_file: str, save_dir: str = PLOT_DIR):
                 col_values.append(cids[i])
         top_clusters_per_col.append(pd.Series(col_values).mode()[0] if col_values else f"Top{i+1}")
 
-    # --- Extract weekday/weekend data ---
-    weekday_line = [l for l in lines if l.startswith("Weekdays:")]
-    weekend_line = [l for l in lines if l.startswith("Weekends:")]
+    # --- Weekday/weekend data ---
+    weekday_dict = {_cluster_label(r["place"]): float(r["hours"]) for r in report["weekday"]}
+    weekend_dict = {_cluster_label(r["place"]): float(r["hours"]) for r in report["weekend"]}
 
-    weekday_parts = re.findall(r"([\d\.]+)\(([\d\.]+)h\)", weekday_line[0]) if weekday_line else []
-    weekend_parts = re.findall(r"([\d\.]+)\(([\d\.]+)h\)", weekend_line[0]) if weekend_line else []
-
-    weekday_dict = {cid: float(h) for cid, h in weekday_parts}
-    weekend_dict = {cid: float(h) for cid, h in weekend_parts}
-
-    cluster_ids = sorted(set(weekday_dict.keys()) | set(weekend_dict.keys()), key=float)
-    wd_hours = [weekday_dict.get(cid, 0) for cid in cluster_ids]
-    we_hours = [weekend_dict.get(cid, 0) for cid in cluster_ids]
+    place_ids = sorted(set(weekday_dict.keys()) | set(weekend_dict.keys()), key=float)
+    wd_hours = [weekday_dict.get(pid, 0) for pid in place_ids]
+    we_hours = [weekend_dict.get(pid, 0) for pid in place_ids]
 
         # --- Create figure ---
     fig, axs = plt.subplots(
@@ -116,14 +174,14 @@ def plot_user_combined(report_file: str, save_dir: str = PLOT_DIR):
 
     # --- Row 2: Weekday vs Weekend bar plot ---
     ax2 = axs[1]
-    x = range(len(cluster_ids))
+    x = range(len(place_ids))
     ax2.bar([i - 0.2 for i in x], wd_hours, width=0.4, label="Weekdays", color="#614AE3")
     ax2.bar([i + 0.2 for i in x], we_hours, width=0.4, label="Weekends", color="#DE3BC5")
     ax2.set_xticks(list(x))
-    ax2.set_xticklabels(cluster_ids, rotation=45)
-    ax2.set_xlabel("Cluster ID")
+    ax2.set_xticklabels(place_ids, rotation=45)
+    ax2.set_xlabel("Place ID")
     ax2.set_ylabel("Hours")
-    ax2.set_title("Weekday vs Weekend Hours by Cluster")
+    ax2.set_title("Weekday vs Weekend Hours by Place")
     ax2.spines['top'].set_visible(False)
     ax2.spines['right'].set_visible(False)
     ax2.legend(title="Day Type", loc='upper left', bbox_to_anchor=(1.02, 1))
@@ -159,11 +217,60 @@ def plot_user_combined(report_file: str, save_dir: str = PLOT_DIR):
     plt.savefig(combined_file)
     plt.close()
     print(f"Combined plot saved for {username}: {combined_file}")
+    return combined_file
 
 
 
 # ---- Process all users ----
-def plot_user_report(report_dir: str = REPORT_DIR, save_dir: str = PLOT_DIR):
-    files = [f for f in os.listdir(report_dir) if f.endswith("_report.txt")]
-    for f in files:
-        plot_user_combined(os.path.join(report_dir, f), save_dir)
+def report_hash(report: dict) -> str:
+    """Hash of everything a figure is drawn from (report content + PLOT_VERSION)."""
+    payload = json.dumps(report, sort_keys=True, default=str) + f"|v{PLOT_VERSION}"
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+
+def _plot_hash_path(username: str, save_dir: str) -> str:
+    return os.path.join(save_dir, f"{username}_combined_plot.json")
+
+
+def plot_if_changed(report: dict, save_dir: str = PLOT_DIR, force: bool = False) -> bool:
+    """
+    Draw the user's figure unless the PNG on disk was drawn from a report
+    with the same content (recorded next to it as <user>_combined_plot.json),
+    so a rerun that rebuilds an identical report leaves the PNG alone.
+    Returns True if the figure was drawn.
+    """
+    username = report["user"]
+    digest = report_hash(report)
+    png = os.path.join(save_dir, f"{username}_combined_plot.png")
+    hash_path = _plot_hash_path(username, save_dir)
+    if not force and os.path.exists(png) and os.path.exists(hash_path):
+        with open(hash_path, "r", encoding="utf-8") as f:
+            if json.load(f).get("report_hash") == digest:
+                print(f"Plot for {username} unchanged: {png}")
+                return False
+
+    plot_user_data(report, save_dir)
+    # written after the PNG, so a failed draw is retried next time
+    with open(hash_path, "w", encoding="utf-8") as f:
+        json.dump({"report_hash": digest}, f)
+    return True
+
+
+def plot_user_report(report_dir: str = REPORT_DIR, save_dir: str = PLOT_DIR, results: dict = None,
+                     force: bool = False):
+    """
+    Plot every user outside the pipeline. With `results` ({username: report
+    dict}) the figures are drawn from in-memory reports; otherwise from
+    report_dir. Users whose report is unchanged are skipped (see
+    plot_if_changed; force=True redraws all).
+    """
+    os.makedirs(save_dir, exist_ok=True)
+    if results is None:
+        files = sorted(f for f in os.listdir(report_dir) if f.endswith("_report.txt"))
+        results = {}
+        for f in files:
+            report = load_report(os.path.join(report_dir, f))
+            results[report["user"]] = report
+
+    drawn = sum(plot_if_changed(report, save_dir, force) for report in results.values())
+    print(f"Plots: {drawn} drawn, {len(results) - drawn} up to date")
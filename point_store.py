@@ -0,0 +1,148 @@
+# point_store.py
+import os
+import json
+import shutil
+from concurrent.futures import ThreadPoolExecutor, wait
+import numpy as np
+import pandas as pd
+from data_load import POINT_DTYPES, compact_points, month_codes, month_label, month_code_of
+
+STORE_COMPRESSION = "zstd"
+INDEX_FILE = "_index.json"
+
+
+def _user_dir(user, root):
+    return os.path.join(root, user)
+
+
+def index_path(user, root):
+    """Written after every partition, so its presence means the store is complete."""
+    return os.path.join(_user_dir(user, root), INDEX_FILE)
+
+
+def _partition_path(user, root, month):
+    return os.path.join(_user_dir(user, root), f"month={month}", "part-0.parquet")
+
+
+def load_index(user, root):
+    path = index_path(user, root)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def write_month(user, root, month, df):
+    """Write one month partition ('month' column dropped), replacing it atomically."""
+    path = _partition_path(user, root, month)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    df = df.drop(columns="month", errors="ignore")
+    df.to_parquet(path + ".tmp", index=False, compression=STORE_COMPRESSION)
+    os.replace(path + ".tmp", path)
+
+
+def drop_index(user, root):
+    """Mark a store incomplete before changing it; returns the old index."""
+    old = load_index(user, root)
+    if old is not None:
+        os.remove(index_path(user, root))
+    return old
+
+
+def write_index(user, root, months, columns, old=None):
+    """
+    Record a complete store: `months` maps 'YYYY-MM' -> rows. Partitions
+    listed in `old` but not in `months` are deleted first.
+    """
+    for label in set(old["months"] if old else ()) - set(months):
+        shutil.rmtree(os.path.dirname(_partition_path(user, root, label)), ignore_errors=True)
+    index = {"columns": [c for c in columns if c != "month"],
+             "months": {label: int(n) for label, n in sorted(months.items())}}
+    with open(index_path(user, root), "w", encoding="utf-8") as f:
+        json.dump(index, f, indent=1, sort_keys=True)
+    return index
+
+
+def write_points(user, df, root, months=None):
+    """
+    Store a user's clustered points as one compressed Parquet file per month
+    under root/<user>/month=YYYY-MM/.
+
+    With `months` only those partitions are rewritten (the others are
+    assumed unchanged on disk); partitions of months no longer in `df` are
+    removed either way. The 'month' column is the partition key and is not
+    stored in the files.
+    """
+    codes = month_codes(df["datetime"])
+    present, counts = np.unique(codes, return_counts=True)
+    labels = [month_label(c) for c in present]
+    to_write = set(labels) if months is None else set(months) & set(labels)
+
+    # drop the index first: a half-updated store must never look complete
+    old = drop_index(user, root)
+    for code, label in zip(present, labels):
+        if label in to_write:
+            write_month(user, root, label, df[codes == code])
+    write_index(user, root, dict(zip(labels, counts)), df.columns, old)
+    return index_path(user, root)
+
+
+def iter_points(user, root, columns=None, months=None):
+    """
+    Yield (month, frame) for a user's stored partitions in month order,
+    one partition in memory at a time.
+
+    Only the requested `columns` are read from the files ('month' is rebuilt
+    from the partition) and only the partitions of `months` ('YYYY-MM'
+    labels) are opened.
+    """
+    index = load_index(user, root)
+    if index is None:
+        raise FileNotFoundError(f"No complete point store for {user} under {root}")
+
+    labels = sorted(index["months"])
+    if months is not None:
+        labels = [m for m in labels if m in set(months)]
+    file_columns = None
+    if columns is not None:
+        file_columns = [c for c in columns if c != "month"]
+        if "datetime" not in file_columns:
+            file_columns.insert(0, "datetime")
+
+    for label in labels:
+        part = pd.read_parquet(_partition_path(user, root, label), columns=file_columns)
+        part["month"] = np.int32(month_code_of(label))
+        part = compact_points(part)
+        yield label, part if columns is None else part[list(columns)]
+
+
+def read_points(user, root, columns=None, months=None):
+    """All of iter_points as one frame in time order."""
+    parts = [part for _, part in iter_points(user, root, columns, months)]
+    if parts:
+        return pd.concat(parts, ignore_index=True)
+    cols = columns or [*load_index(user, root)["columns"], "month"]
+    return pd.DataFrame({c: pd.Series(dtype=POINT_DTYPES.get(c, "float32")) for c in cols})
+
+
+class BackgroundWriter:
+    """
+    One thread that performs artifact writes in submission order while the
+    caller keeps computing. flush() waits for everything submitted so far
+    and re-raises the first write error.
+    """
+
+    def __init__(self):
+        self._pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="writer")
+        self._pending = []
+
+    def submit(self, fn, *args, **kwargs):
+        fut = self._pool.submit(fn, *args, **kwargs)
+        self._pending.append(fut)
+        return fut
+
+    def flush(self):
+        pending, self._pending = self._pending, []
+        wait(pending)
+        for fut in pending:
+            fut.result()
@@ -0,0 +1,65 @@
+# scheduler.py
+import os
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+try:
+    import psutil
+except ImportError:  # optional: only used to respect the memory actually free
+    psutil = None
+
+# Peak working memory of one user relative to the raw CSV size on disk
+# (parsed frame, cleaned copy, clustering arrays and the clustered frame).
+BYTES_PER_CSV_BYTE = 3.0
+
+
+def estimate_user_bytes(source):
+    """Rough peak memory for pushing one user through the pipeline."""
+    return int(os.path.getsize(source) * BYTES_PER_CSV_BYTE)
+
+
+def run_users(sources, fn, max_workers=1, memory_budget=None, estimate=estimate_user_bytes, **kwargs):
+    """
+    Run fn(name, source, **kwargs) once per user on a process pool.
+
+    At most `max_workers` users run at once, and a user is only started
+    while the estimated memory of the running users plus its own stays under
+    `memory_budget` bytes (and under free memory, when psutil is installed).
+    A user larger than the budget still runs, but alone. Each worker returns
+    after writing its artifacts, so nothing per user stays resident.
+    Returns {name: fn result}.
+    """
+    if max_workers <= 1 and memory_budget is None:
+        return {name: fn(name, source, **kwargs) for name, source in sources.items()}
+
+    # biggest users first, so they are not left to run alone at the end
+    pending = sorted(sources.items(), key=lambda item: -estimate(item[1]))
+    results = {}
+    running = {}  # future -> (name, estimated bytes)
+
+    def budget_left():
+        left = memory_budget if memory_budget is not None else float("inf")
+        left -= sum(size for _, size in running.values())
+        if psutil is not None:
+            left = min(left, psutil.virtual_memory().available)
+        return left
+
+    with ProcessPoolExecutor(max_workers=max(1, max_workers)) as pool:
+        while pending or running:
+            # admit as many waiting users as the worker and memory limits allow
+            i = 0
+            while i < len(pending) and len(running) < max_workers:
+                name, source = pending[i]
+                size = estimate(source)
+                if running and size > budget_left():
+                    i += 1
+                    continue
+                running[pool.submit(fn, name, source, **kwargs)] = (name, size)
+                print(f"[scheduler] started {name} (~{size / 2**20:.0f} MB, {len(running)} running)")
+                pending.pop(i)
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for fut in done:
+                name, _ = running.pop(fut)
+                results[name] = fut.result()
+                print(f"[scheduler] finished {name}")
+    return results